@@ -1,10 +1,11 @@
 """Support for Nest devices."""
 from datetime import datetime, timedelta
+from functools import partial
 import logging
-import threading
+import time
 import asyncio
 
-from .nest import Nest
+from .nest import Nest, SUBSCRIBE_TIMEOUT
 #from .nest.nest import APIError, AuthorizationError
 import voluptuous as vol
 
@@ -15,16 +16,17 @@ from homeassistant.const import (
     CONF_MONITORED_CONDITIONS,
     CONF_SENSORS,
     CONF_STRUCTURE,
-    EVENT_HOMEASSISTANT_START,
     EVENT_HOMEASSISTANT_STOP,
 )
 from homeassistant.core import callback
 from homeassistant.helpers import config_validation as cv
-from homeassistant.helpers.dispatcher import async_dispatcher_connect, dispatcher_send
+from homeassistant.helpers.dispatcher import async_dispatcher_connect, async_dispatcher_send
 from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.event import async_track_time_interval
 
 from . import ga_auth
-from .const import DOMAIN, DATA_NEST_CONFIG, CONF_JWT, CONF_USER_ID, CONF_TRANSPORT_URL, CONF_ISSUE_TOKEN, CONF_COOKIE, CONF_REGION
+from .executor import executor, write_executor
+from .const import DOMAIN, DATA_NEST_CONFIG, CONF_JWT, CONF_USER_ID, CONF_TRANSPORT_URL, CONF_ISSUE_TOKEN, CONF_COOKIE, CONF_REGION, CONF_SUBSCRIBE_TIMEOUT, CONF_UPDATE_FRAME, CONF_THROTTLE, CONF_DEADBAND, CONF_MIN_INTERVAL, CONF_MAX_SILENCE, CONF_SUBSCRIBE_SHARDS
 
 _CONFIGURING = {}
 _LOGGER = logging.getLogger(__name__)
@@ -33,15 +35,36 @@ SERVICE_CANCEL_ETA = "cancel_eta"
 SERVICE_SET_ETA = "set_eta"
 
 DATA_NEST = "nestga"
+DATA_NEST_CLIENT = "nestga_client"
 
 SIGNAL_NEST_UPDATE = "nestga_update"
 
+PLATFORMS = ["climate", "camera", "sensor", "binary_sensor"]
+
+# Buckets backing the entities. Thermostats read link, device and shared,
+# cameras read quartz, both take their names from where, and structure
+# entities and services read structure. Nothing reads schedule.
+THERMOSTAT_BUCKETS = ["link", "device", "shared", "where", "structure"]
+CAMERA_BUCKETS = ["quartz", "where"]
+STRUCTURE_BUCKETS = ["structure"]
+SUBSCRIBED_BUCKETS = ["link", "device", "shared", "where", "quartz", "structure"]
+
+# Buckets long-polled together, so camera churn doesn't hold up thermostats
+DEFAULT_SUBSCRIBE_SHARDS = [["quartz"], ["link", "device", "shared", "where", "structure"]]
+
+# Seconds to collect updates before dispatching them as one signal
+DEFAULT_UPDATE_FRAME = 0.2
+
+# How stale a written last_update may get while the state itself is unchanged
+FRESHNESS_INTERVAL = timedelta(minutes=5)
+
 NEST_CONFIG_FILE = "nest.conf"
 
 ATTR_ETA = "eta"
 ATTR_ETA_WINDOW = "eta_window"
 ATTR_STRUCTURE = "structure"
 ATTR_TRIP_ID = "trip_id"
+ATTR_LAST_UPDATE = "last_update"
 
 AWAY_MODE_AWAY = "away"
 AWAY_MODE_HOME = "home"
@@ -49,8 +72,21 @@ AWAY_MODE_HOME = "home"
 ATTR_AWAY_MODE = "away_mode"
 SERVICE_SET_AWAY_MODE = "set_away_mode"
 
+THROTTLE_SCHEMA = vol.Schema(
+    {
+        vol.Optional(CONF_DEADBAND, default=0): vol.All(
+            vol.Coerce(float), vol.Range(min=0)
+        ),
+        vol.Optional(CONF_MIN_INTERVAL): cv.time_period,
+        vol.Optional(CONF_MAX_SILENCE): cv.time_period,
+    }
+)
+
 SENSOR_SCHEMA = vol.Schema(
-    {vol.Optional(CONF_MONITORED_CONDITIONS): vol.All(cv.ensure_list)}
+    {
+        vol.Optional(CONF_MONITORED_CONDITIONS): vol.All(cv.ensure_list),
+        vol.Optional(CONF_THROTTLE): {cv.string: THROTTLE_SCHEMA},
+    }
 )
 
 CONFIG_SCHEMA = vol.Schema(
@@ -63,6 +99,18 @@ CONFIG_SCHEMA = vol.Schema(
                 vol.Optional(CONF_STRUCTURE): vol.All(cv.ensure_list, [cv.string]),
                 vol.Optional(CONF_SENSORS): SENSOR_SCHEMA,
                 vol.Optional(CONF_BINARY_SENSORS): SENSOR_SCHEMA,
+                vol.Optional(
+                    CONF_SUBSCRIBE_TIMEOUT, default=SUBSCRIBE_TIMEOUT
+                ): vol.All(vol.Coerce(int), vol.Range(min=10)),
+                vol.Optional(
+                    CONF_UPDATE_FRAME, default=DEFAULT_UPDATE_FRAME
+                ): vol.All(vol.Coerce(float), vol.Range(min=0, max=5)),
+                vol.Optional(
+                    CONF_SUBSCRIBE_SHARDS, default=DEFAULT_SUBSCRIBE_SHARDS
+                ): vol.All(
+                    cv.ensure_list,
+                    [vol.All(cv.ensure_list, [vol.In(SUBSCRIBED_BUCKETS)])],
+                ),
             }
         )
     },
@@ -92,24 +140,116 @@ CANCEL_ETA_SCHEMA = vol.Schema(
     }
 )
 
-def nest_update_event_broker(hass, nest):
+def nest_update_listener(hass, nest, frame=DEFAULT_UPDATE_FRAME):
+    """
+    Return a listener that wakes the event loop when nest received data.
+    Updates arriving within frame seconds are merged into a single
+    SIGNAL_NEST_UPDATE dispatch carrying the set of changed devices.
+    """
+
+    @callback
+    def async_dispatch_update():
+        """Dispatch the changes collected by the Nest client."""
+        changed, since, updates = nest.pop_changed()
+        if not changed:
+            return
+
+        lag_ms = int((time.monotonic() - since) * 1000)
+        nest.stats["dispatches"] += 1
+        nest.stats["coalesced_updates"] += updates - 1
+        nest.stats["dispatch_lag_ms"] = lag_ms
+        nest.stats["dispatch_lag_max_ms"] = max(nest.stats["dispatch_lag_max_ms"], lag_ms)
+        _LOGGER.debug(
+            "Dispatching nest data update for %d devices from %d updates after %dms",
+            len(changed),
+            updates,
+            lag_ms,
+        )
+        async_dispatcher_send(hass, SIGNAL_NEST_UPDATE, changed)
+
+    def schedule_dispatch():
+        """Schedule a dispatch from the Nest client thread."""
+        hass.loop.call_soon_threadsafe(hass.loop.call_later, frame, async_dispatch_update)
+
+    return schedule_dispatch
+
+def device_changed(changed, *devices):
     """
-    Dispatch SIGNAL_NEST_UPDATE to devices when nest stream API received data.
-    Runs in its own thread.
+    Return whether a dispatched update touched any of the given devices, or
+    the where bucket their names come from.
     """
-    _LOGGER.debug("Listening for nest.update_event")
+    return changed is None or any(
+        device in changed or getattr(device, "where_bucket", None) in changed
+        for device in devices
+    )
+
+def device_buckets(device):
+    """Return the buckets read by the entities of a device, or a structure."""
+    if device is None:
+        return STRUCTURE_BUCKETS
+    if device.is_camera:
+        return CAMERA_BUCKETS
+    return THERMOSTAT_BUCKETS
+
+def freshness_due(written_at):
+    """Return whether a written last_update is old enough to write again."""
+    return (
+        written_at is None
+        or time.monotonic() - written_at >= FRESHNESS_INTERVAL.total_seconds()
+    )
+
+def state_fingerprint(entity):
+    """Return what an entity renders to the state machine, minus freshness."""
+    attributes = dict(entity.device_state_attributes or {})
+    attributes.pop(ATTR_LAST_UPDATE, None)
+    return (
+        entity.state,
+        entity.state_attributes,
+        attributes,
+        entity.name,
+        entity.unit_of_measurement,
+        entity.available,
+    )
 
-    while hass.is_running:
-        nest.update_event.wait()
+class NestStateWriter:
+    """Mixin writing an entity's state when it changed or its last_update is due."""
 
-        if not hass.is_running:
-            break
+    _fingerprint = None
+    _written_at = None
 
-        nest.update_event.clear()
-        _LOGGER.debug("Dispatching nest data update")
-        dispatcher_send(hass, SIGNAL_NEST_UPDATE)
+    @callback
+    def async_write_if_changed(self):
+        """Write the state unless nothing would change, return whether it was."""
+        fingerprint = state_fingerprint(self)
+        if fingerprint == self._fingerprint:
+            if not freshness_due(self._written_at):
+                self._nest.stats["state_writes_skipped"] += 1
+                return False
+            self._nest.stats["state_freshness_writes"] += 1
+        self._nest.stats["state_writes"] += 1
+        self.async_write_state(fingerprint)
+        return True
+
+    @callback
+    def async_write_state(self, fingerprint):
+        """Write the state and remember what and when."""
+        self._fingerprint = fingerprint
+        self._written_at = time.monotonic()
+        self.async_write_ha_state()
+
+def reauthenticate(hass):
+    """Log in to Nest again and return the new session credentials."""
+    conf = hass.data[DATA_NEST_CONFIG]
+    ga_auth.initialize(hass, conf[CONF_ISSUE_TOKEN], conf[CONF_COOKIE], conf[CONF_REGION])
+    account = conf["account"]
+    return account[CONF_JWT], account[CONF_USER_ID], account[CONF_TRANSPORT_URL]
+
+def nest_io_service(hass, handler):
+    """Run a blocking service handler on the Nest write pool."""
+    async def async_handle(service):
+        await write_executor.async_run(hass, handler, service)
 
-    _LOGGER.debug("Stop listening for nest.update_event")
+    return async_handle
 
 async def async_setup(hass, config):
     """Set up Nest components."""
@@ -120,7 +260,9 @@ async def async_setup(hass, config):
     conf["account"] = {}
     hass.data[DATA_NEST_CONFIG] = conf
 
-    ga_auth.initialize(hass, conf[CONF_ISSUE_TOKEN], conf[CONF_COOKIE], conf[CONF_REGION])
+    await executor.async_run(
+        hass, ga_auth.initialize, hass, conf[CONF_ISSUE_TOKEN], conf[CONF_COOKIE], conf[CONF_REGION]
+    )
 
     hass.async_create_task(
         hass.config_entries.flow.async_init(
@@ -137,19 +279,40 @@ async def async_setup_entry(hass, entry):
 
     _LOGGER.debug("setup entry %s %s %s", entry.domain, entry.title, hass.data[DATA_NEST_CONFIG]["account"][CONF_JWT])
 
-    nest = Nest(
-        access_token=hass.data[DATA_NEST_CONFIG]["account"][CONF_JWT],
-        user_id=hass.data[DATA_NEST_CONFIG]["account"][CONF_USER_ID],
-        transport_url=hass.data[DATA_NEST_CONFIG]["account"][CONF_TRANSPORT_URL],
-    )
+    # Reuse the client kept alive by a previous unload instead of logging in
+    # and fetching the whole account again.
+    nest = hass.data.get(DATA_NEST_CLIENT)
+    if nest is None:
+        nest = await executor.async_run(
+            hass,
+            partial(
+                Nest,
+                access_token=hass.data[DATA_NEST_CONFIG]["account"][CONF_JWT],
+                user_id=hass.data[DATA_NEST_CONFIG]["account"][CONF_USER_ID],
+                transport_url=hass.data[DATA_NEST_CONFIG]["account"][CONF_TRANSPORT_URL],
+                subscribe_timeout=hass.data[DATA_NEST_CONFIG].get(
+                    CONF_SUBSCRIBE_TIMEOUT, SUBSCRIBE_TIMEOUT
+                ),
+                reauthenticate=partial(reauthenticate, hass),
+                keep_raw=_LOGGER.isEnabledFor(logging.DEBUG),
+                buckets=SUBSCRIBED_BUCKETS,
+                structures=hass.data[DATA_NEST_CONFIG].get(CONF_STRUCTURE),
+                shards=hass.data[DATA_NEST_CONFIG].get(
+                    CONF_SUBSCRIBE_SHARDS, DEFAULT_SUBSCRIBE_SHARDS
+                ),
+            )
+        )
+        hass.data[DATA_NEST_CLIENT] = nest
+    nest.start()
 
     _LOGGER.debug("proceeding with setup")
     conf = hass.data.get(DATA_NEST_CONFIG, {})
     hass.data[DATA_NEST] = NestDevice(hass, conf, nest)
     if not await hass.async_add_job(hass.data[DATA_NEST].initialize):
+        await executor.async_run(hass, nest.stop)
         return False
 
-    for component in "climate", "camera", "sensor", "binary_sensor":
+    for component in PLATFORMS:
         hass.async_create_task(
             hass.config_entries.async_forward_entry_setup(entry, component)
         )
@@ -238,40 +401,69 @@ async def async_setup_entry(hass, entry):
                     )
 
     hass.services.async_register(
-        DOMAIN, SERVICE_SET_AWAY_MODE, set_away_mode, schema=SET_AWAY_MODE_SCHEMA
+        DOMAIN, SERVICE_SET_AWAY_MODE, nest_io_service(hass, set_away_mode), schema=SET_AWAY_MODE_SCHEMA
     )
 
     hass.services.async_register(
-        DOMAIN, SERVICE_SET_ETA, set_eta, schema=SET_ETA_SCHEMA
+        DOMAIN, SERVICE_SET_ETA, nest_io_service(hass, set_eta), schema=SET_ETA_SCHEMA
     )
 
     hass.services.async_register(
-        DOMAIN, SERVICE_CANCEL_ETA, cancel_eta, schema=CANCEL_ETA_SCHEMA
+        DOMAIN, SERVICE_CANCEL_ETA, nest_io_service(hass, cancel_eta), schema=CANCEL_ETA_SCHEMA
+    )
+
+    nest.set_update_listener(
+        nest_update_listener(hass, nest, conf.get(CONF_UPDATE_FRAME, DEFAULT_UPDATE_FRAME))
     )
 
     @callback
-    def start_up(event):
-        """Start Nest update event listener."""
-        threading.Thread(
-            name="Nest update listener",
-            target=nest_update_event_broker,
-            args=(hass, nest),
-        ).start()
+    def refresh_freshness(now):
+        """Let quiet entities write their last_update again."""
+        async_dispatcher_send(hass, SIGNAL_NEST_UPDATE, None)
 
-    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_START, start_up)
+    hass.data[DATA_NEST].listeners.append(
+        async_track_time_interval(hass, refresh_freshness, FRESHNESS_INTERVAL)
+    )
 
-    @callback
-    def shut_down(event):
-        """Stop Nest update event listener."""
-        nest.update_event.set()
+    async def shut_down(event):
+        """Stop the Nest client."""
+        await executor.async_run(hass, nest.stop)
 
-    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, shut_down)
+    hass.data[DATA_NEST].listeners.append(
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, shut_down)
+    )
 
     _LOGGER.debug("async_setup_nest is done")
 
     return True
 
 
+async def async_unload_entry(hass, entry):
+    """Unload a Nest config entry, keeping the client session for reuse."""
+    unloaded = all(
+        await asyncio.gather(
+            *[
+                hass.config_entries.async_forward_entry_unload(entry, component)
+                for component in PLATFORMS
+            ]
+        )
+    )
+    if not unloaded:
+        return False
+
+    nest_device = hass.data.pop(DATA_NEST)
+    for remove_listener in nest_device.listeners:
+        remove_listener()
+    nest_device.nest.set_update_listener(None)
+
+    for service in SERVICE_SET_AWAY_MODE, SERVICE_SET_ETA, SERVICE_CANCEL_ETA:
+        hass.services.async_remove(DOMAIN, service)
+
+    await executor.async_run(hass, nest_device.nest.stop)
+
+    return True
+
+
 class NestDevice:
     """Structure Nest functions for hass."""
 
@@ -280,6 +472,7 @@ class NestDevice:
         self.hass = hass
         self.nest = nest
         self.local_structure = conf.get(CONF_STRUCTURE)
+        self.listeners = []
 
     def initialize(self):
         """Initialize Nest."""
@@ -312,19 +505,23 @@ class NestDevice:
     def cameras(self):
         """Generate a list of cameras."""
         return self.nest.cameras
-    
-    def update(self, attempts = 0):
-        try:
-            self.nest.update()
-        except KeyError:
-            _LOGGER.debug('update failed')
-            if attempts < 5:
-                conf = self.hass.data[DATA_NEST_CONFIG]
-                ga_auth.initialize(self.hass, conf[CONF_ISSUE_TOKEN], conf[CONF_COOKIE], conf[CONF_REGION])
-                self.update(attempts + 1)
 
+    @property
+    def last_update(self):
+        """Return when the stalest subscription last heard from Nest."""
+        return self.nest.last_update
+
+    def last_update_of(self, buckets):
+        """Return when the subscriptions carrying buckets last heard from Nest."""
+        return self.nest.last_update_of(buckets)
 
-class NestSensorDevice(Entity):
+    @property
+    def stats(self):
+        """Return the Nest client counters."""
+        return self.nest.stats
+
+
+class NestSensorDevice(NestStateWriter, Entity):
     """Representation of a Nest sensor."""
 
     def __init__(self, structure, device, variable, nest):
@@ -342,6 +539,7 @@ class NestSensorDevice(Entity):
             self.device = structure
             self._name = f"{self.structure.name} {self.variable.replace('_', ' ')}"
 
+        self._buckets = device_buckets(device)
         self._state = None
         self._unit = None
 
@@ -365,6 +563,11 @@ class NestSensorDevice(Entity):
         """Return unique id based on device serial and variable."""
         return f"{self.device.serial}-{self.variable}"
 
+    @property
+    def device_state_attributes(self):
+        """Return when the data behind this sensor was last refreshed."""
+        return {ATTR_LAST_UPDATE: self._nest.last_update_of(self._buckets)}
+
     @property
     def device_info(self):
         """Return information about the device."""
@@ -389,12 +592,43 @@ class NestSensorDevice(Entity):
             "model": model,
         }
 
+    def update_from_model(self):
+        """Compute the state from the in-memory Nest model."""
+        raise NotImplementedError()
+
+    async def async_update(self):
+        """Refresh the state without an executor round-trip."""
+        self.update_from_model()
+
+    def should_publish(self):
+        """Return whether a freshly computed state should be written."""
+        return True
+
+    def published(self):
+        """Note that the computed state was written to the state machine."""
+
+    @callback
+    def async_publish(self):
+        """
+        Write the computed state unless it is held back or unchanged. An
+        unchanged state is still written once its last_update is due.
+        """
+        if not self.should_publish():
+            self._nest.stats["state_writes_throttled"] += 1
+            return
+        if self.async_write_if_changed():
+            self.published()
+
     async def async_added_to_hass(self):
         """Register update signal handler."""
 
-        async def async_update_state():
+        @callback
+        def async_update_state(changed=None):
             """Update sensor state."""
-            await self.async_update_ha_state(True)
+            if not device_changed(changed, self.device, self.structure):
+                return
+            self.update_from_model()
+            self.async_publish()
 
         self.async_on_remove(
             async_dispatcher_connect(self.hass, SIGNAL_NEST_UPDATE, async_update_state)
@@ -128,7 +128,7 @@ class NestBinarySensor(NestSensorDevice, BinarySensorDevice):
         """Return the device class of the binary sensor."""
         return _VALID_BINARY_SENSOR_TYPES.get(self.variable)
 
-    def update(self):
+    def update_from_model(self):
         value = getattr(self.device, self.variable)
         if self.variable in STRUCTURE_BINARY_TYPES:
             self._state = bool(STRUCTURE_BINARY_STATE_MAP[self.variable].get(value))
@@ -154,5 +154,5 @@ class NestActivityZoneSensor(NestBinarySensor):
         """Return the device class of the binary sensor."""
         return "motion"
     
-    def update(self):
+    def update_from_model(self):
         self._state = self.device.has_ongoing_motion_in_zone(self.zone.zone_id)
@@ -1,13 +1,17 @@
 """Support for Nest Cameras."""
 from datetime import timedelta
+import hashlib
 import logging
+import time
 
-import requests
-
-from . import DATA_NEST, DOMAIN, DATA_NEST_CONFIG
-from .const import CONF_ISSUE_TOKEN, CONF_COOKIE, CONF_REGION, CONF_JWT
+from . import ATTR_LAST_UPDATE, CAMERA_BUCKETS, DATA_NEST, DOMAIN, DATA_NEST_CONFIG
+from .const import CONF_ISSUE_TOKEN, CONF_COOKIE, CONF_REGION, CONF_JWT, CONNECT_TIMEOUT, READ_TIMEOUT
 from . import ga_auth
+from .executor import executor
+from .scheduler import SNAPSHOT, CircuitOpen, RateLimited, scheduler
 from homeassistant.components.camera import PLATFORM_SCHEMA, SUPPORT_ON_OFF, Camera
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_call_later
 from homeassistant.util.dt import utcnow
 
 _LOGGER = logging.getLogger(__name__)
@@ -18,6 +22,12 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({})
 
 CAMERA_URL = 'https://nexusapi-{}1.camera.home.nest.com'
 
+# Seconds a camera counts as viewed after its image was last requested,
+# and as active after motion was last seen. The frontend asks for
+# thumbnails every 10 seconds.
+VIEWER_TIMEOUT = 30
+MOTION_TIMEOUT = 120
+
 def setup_platform(hass, config, add_entities, discovery_info=None):
     """Set up a Nest Cam.
 
@@ -44,7 +54,16 @@ class NestCamera(Camera):
         self.device = device
         # Default to non-NestAware subscribed, but will be fixed during update
         self._last_image = None
+        self._image_hash = None
+        # Validators for conditional snapshot requests
+        self._image_etag = None
+        self._image_modified = None
         self._next_snapshot_at = None
+        # Monotonic times of the last image request and motion, which keep
+        # the snapshot refreshed in the background
+        self._last_viewed = None
+        self._last_motion = None
+        self._cancel_refresh = None
         self._hass = hass
         self._nest = nest
 
@@ -68,6 +87,11 @@ class NestCamera(Camera):
             "model": "Camera",
         }
 
+    @property
+    def device_state_attributes(self):
+        """Return when the camera data was last refreshed."""
+        return {ATTR_LAST_UPDATE: self._nest.last_update_of(CAMERA_BUCKETS)}
+
     @property
     def should_poll(self):
         """Nest camera should poll periodically."""
@@ -93,27 +117,25 @@ class NestCamera(Camera):
         """Return true if on."""
         return self._online and self._is_streaming
 
-    def turn_off(self):
+    async def async_turn_off(self):
         """Turn off camera."""
         _LOGGER.debug("Turn off camera %s", self._name)
-        self._nest.nest.dropcam.set_properties({
-            "streaming.enabled": False,
-            "uuid": self.device.id
-        })
+        await self._nest.nest.async_set_camera_properties(
+            [self.device.id], {"streaming.enabled": False}
+        )
 
-    def turn_on(self):
+    async def async_turn_on(self):
         """Turn on camera."""
         if not self._online:
             _LOGGER.error("Camera %s is offline.", self._name)
             return
 
         _LOGGER.debug("Turn on camera %s", self._name)
-        self._nest.nest.dropcam.set_properties({
-            "streaming.enabled": True,
-            "uuid": self.device.id
-        })
+        await self._nest.nest.async_set_camera_properties(
+            [self.device.id], {"streaming.enabled": True}
+        )
 
-    def update(self):
+    async def async_update(self):
         self._location = self.device.where
         self._name = self.device.name
         self._online = self.device.online
@@ -127,31 +149,116 @@ class NestCamera(Camera):
             # Otherwise, 2/min
             self._time_between_snapshots = timedelta(seconds=30)
 
+        if self.device.motion_detected or self.device.person_detected:
+            self._last_motion = time.monotonic()
+            self._async_schedule_refresh()
+
+    async def async_will_remove_from_hass(self):
+        """Stop refreshing the snapshot."""
+        if self._cancel_refresh is not None:
+            self._cancel_refresh()
+            self._cancel_refresh = None
+
+    def _wants_refresh(self):
+        now = time.monotonic()
+        return self.is_on and (
+            (self._last_viewed is not None and now - self._last_viewed < VIEWER_TIMEOUT)
+            or (self._last_motion is not None and now - self._last_motion < MOTION_TIMEOUT)
+        )
+
+    @callback
+    def _async_schedule_refresh(self):
+        """Keep the snapshot warm while the camera is viewed or active."""
+        if self._cancel_refresh is not None or not self._wants_refresh():
+            return
+        self._cancel_refresh = async_call_later(
+            self._hass, self._time_between_snapshots.total_seconds(), self._async_refresh
+        )
+
+    async def _async_refresh(self, now):
+        """Fetch the next snapshot ahead of the viewers asking for it."""
+        self._cancel_refresh = None
+        if not self._wants_refresh():
+            _LOGGER.debug("Camera %s idle, pausing snapshot refresh", self._name)
+            return
+        try:
+            await executor.async_run(self._hass, self.camera_image)
+            self._nest.stats["snapshots_refreshed"] += 1
+        except Exception:
+            # A failed snapshot must not stop the refresher
+            self._nest.stats["snapshot_refresh_errors"] += 1
+            _LOGGER.exception("Failed to refresh snapshot of camera %s", self._name)
+        self._async_schedule_refresh()
+
     def _ready_for_snapshot(self, now):
         return self._next_snapshot_at is None or now > self._next_snapshot_at
 
     def camera_image(self):
         """Return a still image response from the camera."""
         now = utcnow()
+        if not self.is_on:
+            # No new frames while the camera is off or offline
+            self._nest.stats["snapshots_skipped_off"] += 1
+            return self._last_image
         if self._ready_for_snapshot(now):
             conf = self._hass.data[DATA_NEST_CONFIG]
             account_conf = conf["account"]
 
             _LOGGER.debug('camera auth %s', account_conf[CONF_JWT])
 
-            response = requests.get(
-                f'{CAMERA_URL.format(conf[CONF_REGION])}/get_image?uuid={self.device.id}' +
-                f'&cachebuster={now}',
-                headers={"cookie": f'user_token={account_conf[CONF_JWT]}'},
-            )
+            url = f'{CAMERA_URL.format(conf[CONF_REGION])}/get_image?uuid={self.device.id}'
+            headers = {"cookie": f'user_token={account_conf[CONF_JWT]}'}
+            if self._image_etag is not None:
+                headers["If-None-Match"] = self._image_etag
+            if self._image_modified is not None:
+                headers["If-Modified-Since"] = self._image_modified
+            if self._image_etag is None and self._image_modified is None:
+                # Validators only work against the same URL, without them
+                # bust any cache in between
+                url += f'&cachebuster={now}'
+
+            try:
+                response = scheduler.request(
+                    SNAPSHOT,
+                    'get',
+                    url,
+                    headers=headers,
+                    timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                )
+            except (RateLimited, CircuitOpen):
+                # Throttled or unavailable rather than logged out, keep the
+                # last image
+                return self._last_image
 
             _LOGGER.debug('fetch camera image %d', response.status_code)
 
-            if (response.status_code == 200):
+            if response.status_code == 304:
+                self._next_snapshot_at = now + self._time_between_snapshots
+                self._nest.stats["snapshots_not_modified"] += 1
+            elif (response.status_code == 200):
                 self._next_snapshot_at = now + self._time_between_snapshots
-                self._last_image = response.content
+                self._image_etag = response.headers.get("ETag")
+                self._image_modified = response.headers.get("Last-Modified")
+                image_hash = hashlib.sha1(response.content).digest()
+                if image_hash == self._image_hash:
+                    # Same frame, hand out the image viewers already have
+                    self._nest.stats["snapshots_unchanged"] += 1
+                else:
+                    self._nest.stats["snapshots_fetched"] += 1
+                    self._image_hash = image_hash
+                    self._last_image = response.content
             else:
                 conf = self._hass.data[DATA_NEST_CONFIG]
                 ga_auth.initialize(self._hass, conf[CONF_ISSUE_TOKEN], conf[CONF_COOKIE], conf[CONF_REGION])
 
-        return self._last_image
\ No newline at end of file
+        return self._last_image
+
+    async def async_camera_image(self):
+        """Return a still image response on the Nest I/O pool."""
+        self._last_viewed = time.monotonic()
+        if self._cancel_refresh is not None and self._last_image is not None:
+            # Kept fresh in the background
+            return self._last_image
+        image = await executor.async_run(self._hass, self.camera_image)
+        self._async_schedule_refresh()
+        return image
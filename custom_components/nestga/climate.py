@@ -1,7 +1,7 @@
 """Support for Nest thermostats."""
+from functools import partial
 import logging
 
-from nest.nest import APIError
 import voluptuous as vol
 
 from homeassistant.components.climate import PLATFORM_SCHEMA, ClimateDevice
@@ -31,9 +31,20 @@ from homeassistant.const import (
     TEMP_CELSIUS,
     TEMP_FAHRENHEIT,
 )
+from homeassistant.core import callback
 from homeassistant.helpers.dispatcher import async_dispatcher_connect
 
-from . import DATA_NEST, DOMAIN as NEST_DOMAIN, SIGNAL_NEST_UPDATE
+from . import (
+    ATTR_LAST_UPDATE,
+    DATA_NEST,
+    DOMAIN as NEST_DOMAIN,
+    SIGNAL_NEST_UPDATE,
+    THERMOSTAT_BUCKETS,
+    NestStateWriter,
+    device_changed,
+)
+from .executor import write_executor
+from .nest import APIError
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -91,7 +102,7 @@ async def async_setup_entry(hass, entry, async_add_entities):
     async_add_entities(all_devices, True)
 
 
-class NestThermostat(ClimateDevice):
+class NestThermostat(NestStateWriter, ClimateDevice):
     """Representation of a Nest thermostat."""
 
     def __init__(self, structure, device, temp_unit, nest):
@@ -134,9 +145,13 @@ class NestThermostat(ClimateDevice):
     async def async_added_to_hass(self):
         """Register update signal handler."""
 
-        async def async_update_state():
+        @callback
+        def async_update_state(changed=None):
             """Update device state."""
-            await self.async_update_ha_state(True)
+            if not device_changed(changed, self.device, self.structure):
+                return
+            self.update_from_model()
+            self.async_write_if_changed()
 
         self.async_on_remove(
             async_dispatcher_connect(self.hass, SIGNAL_NEST_UPDATE, async_update_state)
@@ -152,6 +167,11 @@ class NestThermostat(ClimateDevice):
         """Return unique ID for this device."""
         return self.device.serial
 
+    @property
+    def device_state_attributes(self):
+        """Return when the thermostat data was last refreshed."""
+        return {ATTR_LAST_UPDATE: self._nest.last_update_of(THERMOSTAT_BUCKETS)}
+
     @property
     def device_info(self):
         """Return information about the device."""
@@ -243,10 +263,18 @@ class NestThermostat(ClimateDevice):
             # restore target temperature
             self.schedule_update_ha_state(True)
 
+    async def async_set_temperature(self, **kwargs):
+        """Set new target temperature on the Nest write pool."""
+        await write_executor.async_run(self.hass, partial(self.set_temperature, **kwargs))
+
     def set_hvac_mode(self, hvac_mode):
         """Set operation mode."""
         self.device.mode = MODE_HASS_TO_NEST[hvac_mode]
 
+    async def async_set_hvac_mode(self, hvac_mode):
+        """Set operation mode on the Nest write pool."""
+        await write_executor.async_run(self.hass, self.set_hvac_mode, hvac_mode)
+
     @property
     def hvac_modes(self):
         """List of available operation modes."""
@@ -290,6 +318,10 @@ class NestThermostat(ClimateDevice):
             else:
                 self.device.mode = self.device.previous_mode
 
+    async def async_set_preset_mode(self, preset_mode):
+        """Set preset mode on the Nest write pool."""
+        await write_executor.async_run(self.hass, self.set_preset_mode, preset_mode)
+
     @property
     def fan_mode(self):
         """Return whether the fan is on."""
@@ -311,6 +343,10 @@ class NestThermostat(ClimateDevice):
         if self._has_fan:
             self.device.fan = fan_mode.lower()
 
+    async def async_set_fan_mode(self, fan_mode):
+        """Turn fan on/off on the Nest write pool."""
+        await write_executor.async_run(self.hass, self.set_fan_mode, fan_mode)
+
     @property
     def min_temp(self):
         """Identify min_temp in Nest API or defaults if not available."""
@@ -321,23 +357,29 @@ class NestThermostat(ClimateDevice):
         """Identify max_temp in Nest API or defaults if not available."""
         return self._max_temperature
 
-    def update(self):
+    async def async_update(self):
+        """Refresh the state without an executor round-trip."""
+        self.update_from_model()
+
+    def update_from_model(self):
         _LOGGER.debug('update climate %s', self.device)
-        self._location = self.device.where
-        self._name = self.device.name
-        self._humidity = self.device.humidity
-        self._temperature = self.device.temperature
-        self._mode = self.device.mode
-        self._action = self.device.hvac_state
-        self._target_temperature = self.device.target
-        self._fan = self.device.fan
+        # Read one consistent revision of the thermostat data
+        device = self.device.snapshot()
+        self._location = device.where
+        self._name = device.name
+        self._humidity = device.humidity
+        self._temperature = device.temperature
+        self._mode = device.mode
+        self._action = device.hvac_state
+        self._target_temperature = device.target
+        self._fan = device.fan
         self._away = self.structure.away == "away"
-        self._eco_temperature = self.device.eco_temperature
-        self._locked_temperature = self.device.locked_temperature
-        self._min_temperature = self.device.min_temperature
-        self._max_temperature = self.device.max_temperature
-        self._is_locked = self.device.is_locked
-        if self.device.temperature_scale == "C":
+        self._eco_temperature = device.eco_temperature
+        self._locked_temperature = device.locked_temperature
+        self._min_temperature = device.min_temperature
+        self._max_temperature = device.max_temperature
+        self._is_locked = device.is_locked
+        if device.temperature_scale == "C":
             self._temperature_scale = TEMP_CELSIUS
         else:
             self._temperature_scale = TEMP_FAHRENHEIT
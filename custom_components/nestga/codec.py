@@ -0,0 +1,113 @@
+"""JSON encoding for Nest requests and responses."""
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    NAME = 'orjson'
+    JSONDecodeError = orjson.JSONDecodeError
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+else:
+    NAME = 'json'
+    JSONDecodeError = json.JSONDecodeError
+
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+# Scanning works on the raw bytes: the bytes of multibyte UTF-8 characters
+# never match the ASCII quotes, brackets and backslashes looked for
+_WHITESPACE = re.compile(rb'[\s,]*')
+# A whole string, and everything up to and including the next bracket
+# outside a string, written as unrolled loops so they don't backtrack
+_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_TO_BRACKET = re.compile(rb'[^"{}\[\]]*(?:%s[^"{}\[\]]*)*([{}\[\]])' % _STRING, re.S)
+_SCALAR_END = re.compile(rb'[\s,\]]')
+# Objects and arrays nested this deep are matched in one go, deeper ones
+# bracket by bracket
+NESTED_DEPTH = 8
+
+
+def _nested(depth):
+    inner = _STRING if depth == 1 else b'%s|%s' % (_STRING, _nested(depth - 1))
+    return rb'[{\[][^"{}\[\]]*(?:(?:%s)[^"{}\[\]]*)*[}\]]' % inner
+
+
+_NESTED = re.compile(_nested(NESTED_DEPTH), re.S)
+_STRING = re.compile(_STRING, re.S)
+
+
+def _value_end(buffer, pos):
+    """
+    Return where the JSON value starting at pos ends, or None if it hasn't
+    been received completely. Only finds the end, decoding is left to loads.
+    """
+    first = buffer[pos:pos + 1]
+    if first == b'"':
+        match = _STRING.match(buffer, pos)
+        return None if match is None else match.end()
+    if first not in (b'{', b'['):
+        match = _SCALAR_END.search(buffer, pos)
+        return None if match is None else match.start()
+    match = _NESTED.match(buffer, pos)
+    if match is not None:
+        return match.end()
+    depth = 0
+    while True:
+        # Matched from pos on rather than searched, so an unterminated
+        # string can't be taken for its contents
+        match = _TO_BRACKET.match(buffer, pos)
+        if match is None:
+            return None
+        depth += 1 if match.group(1) in (b'{', b'[') else -1
+        pos = match.end()
+        if depth == 0:
+            return pos
+
+
+def iter_items(chunks, key):
+    """
+    Yield the elements of the array stored under key in a JSON object as
+    soon as each one has been received, reading the document from an
+    iterable of byte chunks. Raises KeyError if the array never appears.
+    """
+    start = re.compile(rb'"%s"\s*:\s*\[' % re.escape(key.encode()))
+    buffer = b''
+    pos = None
+    for chunk in chunks:
+        buffer += chunk
+        if pos is None:
+            match = start.search(buffer)
+            if match is None:
+                # Only keep enough to match a key split across chunks
+                buffer = buffer[-(len(key) + 64):]
+                continue
+            pos = match.end()
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if buffer[pos:pos + 1] == b']':
+                return
+            end = None if pos == len(buffer) else _value_end(buffer, pos)
+            if end is None:
+                # Incomplete element, wait for more data
+                break
+            yield loads(buffer[pos:end])
+            pos = end
+        buffer = buffer[pos:]
+        pos = 0
+    if pos is None:
+        raise KeyError(key)
+    raise json.JSONDecodeError(
+        'Unterminated array', buffer.decode('utf-8', 'replace'), pos)
@@ -13,6 +13,7 @@ from homeassistant.exceptions import HomeAssistantError
 from homeassistant.util.json import load_json
 
 from .const import DOMAIN, CONF_ISSUE_TOKEN, CONF_COOKIE, CONF_REGION
+from .executor import executor
 from .ga_auth import get_google_access_token
 
 DATA_FLOW_IMPL = "nest_ga_flow_implementation"
@@ -71,7 +72,8 @@ class NestFlowHandler(config_entries.ConfigFlow):
             return self.async_abort(reason="already_setup")
 
         if user_input is not None:
-            can_connect = await self.hass.async_add_executor_job(
+            can_connect = await executor.async_run(
+                self.hass,
                 try_connection,
                 user_input[CONF_ISSUE_TOKEN],
                 user_input[CONF_COOKIE]
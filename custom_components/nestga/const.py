@@ -7,6 +7,16 @@ DATA_NEST_CONFIG = "nestga_config"
 CONF_USER_ID = "user_id"
 CONF_JWT = "jwt"
 CONF_TRANSPORT_URL = "transport_url"
+CONF_SUBSCRIBE_TIMEOUT = "subscribe_timeout"
+CONF_UPDATE_FRAME = "update_frame"
+CONF_THROTTLE = "throttle"
+CONF_DEADBAND = "deadband"
+CONF_MIN_INTERVAL = "min_interval"
+CONF_MAX_SILENCE = "max_silence"
+CONF_SUBSCRIBE_SHARDS = "subscribe_shards"
+# Seconds to connect to and hear back from Nest, unless a call says otherwise
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
 USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_5) " \
              "AppleWebKit/537.36 (KHTML, like Gecko) " \
              "Chrome/75.0.3770.100 Safari/537.36"
\ No newline at end of file
@@ -1,23 +1,43 @@
+import asyncio
 import logging
-import json
 import requests
 
-from .const import USER_AGENT
+from . import codec
+from .executor import write_executor
+from .const import CONNECT_TIMEOUT, READ_TIMEOUT, USER_AGENT
+from .scheduler import POLL, WRITE, scheduler
 
 _LOGGER = logging.getLogger(__name__)
 
 API_URL = "https://webapi.camera.home.nest.com/api/"
 
 class Dropcam:
-    def __init__(self, access_token):
+    def __init__(self, access_token, session=None):
         self._access_token = access_token
+        self._session = session or requests.Session()
 
     def set_properties(self, properties):
-        self.post('dropcams.set_properties', properties)
+        return self.post('dropcams.set_properties', properties)
+
+    async def async_set_properties(self, uuids, properties):
+        """
+        Set the same properties on many cameras concurrently on the Nest
+        write pool and return the uuids that took them.
+        """
+        uuids = list(uuids)
+        results = await asyncio.gather(*(
+            asyncio.wrap_future(
+                write_executor.submit(self.set_properties, {**properties, 'uuid': uuid}))
+            for uuid in uuids
+        ))
+        return [uuid for uuid, result in zip(uuids, results) if result is not None]
     
     def get(self, path):
         try:
-            response = requests.get(f"{API_URL}{path}", headers=self._default_headers())
+            response = scheduler.request(
+                POLL, 'get', f"{API_URL}{path}", session=self._session,
+                headers=self._default_headers(),
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
             return self._handle_response(response)
         except requests.exceptions.RequestException as e:
             _LOGGER.error(e)
@@ -25,7 +45,10 @@ class Dropcam:
     def post(self, path, data):
         try:
             _LOGGER.debug('post %s', data)
-            response = requests.post(f"{API_URL}{path}", data=data, headers=self._default_headers())
+            response = scheduler.request(
+                WRITE, 'post', f"{API_URL}{path}", session=self._session, data=data,
+                headers=self._default_headers(),
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
             return self._handle_response(response)
         except requests.exceptions.RequestException as e:
             _LOGGER.error(e)
@@ -41,7 +64,7 @@ class Dropcam:
     def _handle_response(self, response):
         try:
             _LOGGER.debug('dc response %s', response.text)
-            return response.json()
-        except json.JSONDecodeError as e:
+            return codec.loads(response.content)
+        except codec.JSONDecodeError as e:
             _LOGGER.error("Failed to decode JSON %s %s", response.text, e)
         
\ No newline at end of file
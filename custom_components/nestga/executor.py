@@ -0,0 +1,55 @@
+"""Bounded worker pool for the integration's blocking Nest I/O."""
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+# Threads doing Nest I/O at once, so a hung Nest socket can't starve the
+# executor Home Assistant shares with other integrations
+MAX_WORKERS = 4
+# Threads for writes and services, apart from snapshot fetches so those
+# can't hold writes back
+WRITE_WORKERS = 2
+
+
+class IOExecutor(object):
+    """Thread pool that counts its queue depth and how long jobs wait."""
+    def __init__(self, max_workers=MAX_WORKERS, name='io'):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f'nestga_{name}')
+        self._name = name
+        self._lock = threading.Lock()
+        self._queued = 0
+        self.stats = collections.Counter()
+
+    @property
+    def queue_depth(self):
+        return self._queued
+
+    def submit(self, func, *args):
+        submitted = time.monotonic()
+        with self._lock:
+            self._queued += 1
+            self.stats[f'{self._name}_queue_max'] = max(
+                self.stats[f'{self._name}_queue_max'], self._queued)
+
+        def run():
+            waited = int((time.monotonic() - submitted) * 1000)
+            with self._lock:
+                self._queued -= 1
+                self.stats[f'{self._name}_jobs'] += 1
+                self.stats[f'{self._name}_wait_ms'] = waited
+                self.stats[f'{self._name}_wait_max_ms'] = max(
+                    self.stats[f'{self._name}_wait_max_ms'], waited)
+            return func(*args)
+
+        return self._executor.submit(run)
+
+    def async_run(self, hass, func, *args):
+        """Run func on the pool and return an awaitable for its result."""
+        return asyncio.wrap_future(self.submit(func, *args), loop=hass.loop)
+
+
+executor = IOExecutor()
+write_executor = IOExecutor(WRITE_WORKERS, 'write')
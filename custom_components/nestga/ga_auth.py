@@ -1,12 +1,12 @@
 """GA Nest authentication."""
 import asyncio
 from homeassistant.core import callback
-import requests
 import logging
 
 _LOGGER = logging.getLogger(__name__)
 
-from .const import DATA_NEST_CONFIG, CONF_JWT, CONF_USER_ID, CONF_TRANSPORT_URL
+from .const import DATA_NEST_CONFIG, CONF_JWT, CONF_USER_ID, CONF_TRANSPORT_URL, CONNECT_TIMEOUT, READ_TIMEOUT
+from .scheduler import AUTH, scheduler
 
 API_HOSTNAME = 'home.nest.com'
 USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_5) " \
@@ -34,7 +34,9 @@ def get_google_access_token(issue_token, cookie):
         'Referer': 'https://accounts.google.com/o/oauth2/iframe',
         'cookie': cookie
     }
-    response = requests.get(url=issue_token, headers=headers)
+    response = scheduler.request(
+        AUTH, 'get', issue_token, headers=headers,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
     return response.json()['access_token']
 
 def get_jwt(google_access_token):
@@ -51,10 +53,13 @@ def get_jwt(google_access_token):
         'google_oauth_access_token': google_access_token,
         'policy_id': 'authproxy-oauth-policy'
     }
-    response = requests.post(
+    response = scheduler.request(
+        AUTH,
+        'post',
         URL_JWT,
         data=data,
-        headers=headers
+        headers=headers,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
     )
     jwt = response.json()['jwt']
     return jwt
@@ -65,9 +70,12 @@ def get_token(access_token):
         'User-Agent': USER_AGENT,
         'Cookie': 'G_ENABLED_IDPS=google; eu_cookie_accepted=1; viewer-volume=0.5; cztoken=' + access_token
     }
-    response = requests.get(
+    response = scheduler.request(
+        AUTH,
+        'get',
         URL_AUTH,
-        headers=headers
+        headers=headers,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
     )
     json = response.json()
     _LOGGER.debug('get token response %s', json)
@@ -2,21 +2,43 @@ import logging
 import requests
 import copy
 import uuid
-import json
 import collections
 import datetime
+import random
+import socket
+import sys
 import threading
+import time
+import weakref
 
-from threading import Timer
 from dateutil.parser import parse as parse_time
 
-from .const import USER_AGENT
+from . import codec
+from .const import CONNECT_TIMEOUT, READ_TIMEOUT, USER_AGENT
 from .dropcam import Dropcam
+from .scheduler import POLL, WRITE, CircuitOpen, RateLimited, scheduler
 
 _LOGGER = logging.getLogger(__name__)
 
 API_URL = 'https://home.nest.com'
 ENDPOINT_SUBSCRIBE = '/v5/subscribe'
+ENDPOINT_PUT = '/v5/put'
+
+# Seconds between successful subscribe calls
+POLL_INTERVAL = 1
+# Seconds a subscribe call may go without data before it ends as an idle cycle
+SUBSCRIBE_TIMEOUT = 120
+# Seconds a write, or the fetch of its confirming revision, may take
+WRITE_TIMEOUT = 10
+WATCHDOG_INTERVAL = 5
+BACKOFF_MIN = 1
+BACKOFF_MAX = 300
+BACKOFF_JITTER = 0.5
+REAUTH_AFTER_FAILURES = 3
+# Seconds stop() waits for the client threads to finish
+STOP_TIMEOUT = 5
+# Bytes read at a time when streaming the app_launch response
+STREAM_CHUNK_SIZE = 64 * 1024
 
 DEVICE = 'device'
 METADATA = 'metadata'
@@ -64,41 +86,205 @@ BUCKETS = {
     "structure": STRUCTURE
 }
 
+# Legacy hvac modes and the web API target_temperature_type values. Eco
+# lives elsewhere in the web API and isn't written.
+HVAC_MODES_TO_WEB = {
+    'heat': 'heat',
+    'cool': 'cool',
+    'heat-cool': 'range',
+    'off': 'off',
+}
+HVAC_MODES_FROM_WEB = {web: legacy for legacy, web in HVAC_MODES_TO_WEB.items()}
+
+
+def _web_hvac_mode(mode):
+    if mode not in HVAC_MODES_TO_WEB:
+        raise NotImplementedError(f"Setting hvac mode {mode} is not supported")
+    return HVAC_MODES_TO_WEB[mode]
+
+
+# Legacy developer API fields the setters write, by path, and the web API
+# bucket, field and value conversion they map to. Web API temperatures are
+# always Celsius. Fields not listed here are refused rather than sent in a
+# format the web API doesn't use.
+WRITE_FIELDS = {
+    ('devices/thermostats', 'target_temperature'): ('shared', 'target_temperature', None),
+    ('devices/thermostats', 'target_temperature_low'): ('shared', 'target_temperature_low', None),
+    ('devices/thermostats', 'target_temperature_high'): ('shared', 'target_temperature_high', None),
+    ('devices/thermostats', 'hvac_mode'): ('shared', 'target_temperature_type', _web_hvac_mode),
+    ('structures', 'away'): ('structure', 'away', lambda away: away == 'away'),
+}
+
+# Quartz fields mirroring Dropcam properties, so property writes show up
+# before the camera reports them back
+DROPCAM_PROPERTY_FIELDS = {
+    'streaming.enabled': lambda enabled: {
+        'streaming_state': 'streaming-enabled' if enabled else 'streaming-disabled',
+    },
+}
+
 SIMULATOR_SNAPSHOT_URL = \
     'https://developer.nest.com' \
     '/simulator/api/v1/nest/devices/camera/snapshot'
 SIMULATOR_SNAPSHOT_PLACEHOLDER_URL = \
     'https://media.giphy.com/media/WCwFvyeb6WJna/giphy.gif'
 
+class APIError(Exception):
+    pass
+
+class AbortableAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter that remembers its sockets, so requests blocked on
+    them can be cut off from another thread. Closing a session only drops
+    idle connections.
+    """
+    def __init__(self, *args, **kwargs):
+        self._sockets = weakref.WeakSet()
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        sockets = self._sockets
+
+        def tracked(connection_cls):
+            class Connection(connection_cls):
+                def connect(self):
+                    super().connect()
+                    sockets.add(self.sock)
+            return Connection
+
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: type(pool_cls.__name__, (pool_cls,), {
+                'ConnectionCls': tracked(pool_cls.ConnectionCls),
+            })
+            for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+    def abort(self):
+        """Shut down every open socket, failing the requests using them."""
+        for sock in list(self._sockets):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
 def nest_object(type, id, data, nest_api):
-    _LOGGER.debug('find object for type %s', type)
-    for cls in NestBase.__subclasses__():
-        if cls.is_handler_for(type):
-            _LOGGER.debug('found %s', cls)
-            return cls(id, data, nest_api)
-    for cls in Device.__subclasses__():
-        if cls.is_handler_for(type):
-            _LOGGER.debug('found %s', cls)
-            return cls(id, data, nest_api)
-    _LOGGER.error('Failed to find device with ID %s and type %s', id, type)
-    raise ValueError
+    cls = HANDLERS.get(type)
+    if cls is None:
+        _LOGGER.error('Failed to find device with ID %s and type %s', id, type)
+        raise ValueError
+    return cls(id, data, nest_api)
 
 class Nest(object):
-    def __init__(self, access_token, user_id, transport_url):
+    def __init__(self, access_token, user_id, transport_url,
+                 subscribe_timeout=SUBSCRIBE_TIMEOUT, reauthenticate=None,
+                 keep_raw=False, stream_app_launch=True, buckets=None,
+                 structures=None, shards=None):
         self._access_token = access_token
         self._user_id = user_id
         self._transport_url = transport_url
+        self._subscribe_timeout = subscribe_timeout
+        self._reauthenticate = reauthenticate
+        self.keep_raw = keep_raw
+        self._stream_app_launch = stream_app_launch
+        # Bucket types and structure names to subscribe to, None for all
+        self._buckets = frozenset(BUCKETS if buckets is None else buckets)
+        self._structure_names = None if structures is None else set(structures)
+        # Ids of the configured and other structures, and the structure of
+        # each device
+        self._local_structures = set()
+        self._foreign_structures = set()
+        self._device_structures = {}
+        # Buckets long-polled together, unlisted buckets join the last shard
+        self._shards = [list(shard) for shard in shards or [self._buckets]]
+        self._shard_of = {
+            bucket: index
+            for index, shard in enumerate(self._shards) for bucket in shard
+        }
         self._storage = Storage()
-        self._last_update = None
-        self._objects = {}
-        self._update_event = threading.Event()
-        self.dropcam = Dropcam(self._access_token)
-        self.update()
-    
+        self._objects = [SubscribeBody() for _ in self._shards]
+        self._launched = False
+        self._launch_lock = threading.Lock()
+        # When each shard last completed a cycle
+        self._shard_updates = [None] * len(self._shards)
+        self._headers = None
+        self._update_listener = None
+        self._changed_lock = threading.Lock()
+        self._changed = set()
+        self._changed_since = None
+        self._changed_updates = 0
+        self._loop_lock = threading.Lock()
+        self._generations = [0] * len(self._shards)
+        self._cycle_started = [None] * len(self._shards)
+        self._stopped = threading.Event()
+        self._stopped.set()
+        self._aborting = False
+        self._threads = []
+        self._session = self._poll_session()
+        # Writes get their own connection so they never queue behind a
+        # long-poll, and remember when each object was written
+        self._write_lock = threading.Lock()
+        self._write_session = requests.Session()
+        self._pending_writes = {}
+        self.stats = collections.Counter()
+        self.dropcam = Dropcam(self._access_token, self._write_session)
+        try:
+            self.update()
+        except Exception as e:
+            _LOGGER.warning('Initial update failed, will retry %s', e)
+
     @property
-    def update_event(self):
-        return self._update_event
-    
+    def last_update(self):
+        """When the stalest shard with objects last completed a cycle."""
+        return self._oldest(range(len(self._shards)))
+
+    def last_update_of(self, buckets):
+        """When the stalest shard carrying any of buckets last completed a cycle."""
+        last = len(self._shards) - 1
+        return self._oldest({self._shard_of.get(bucket, last) for bucket in buckets})
+
+    @property
+    def shard_updates(self):
+        """Return the buckets and last completed cycle of each shard."""
+        return list(zip(self._shards, self._shard_updates))
+
+    def _oldest(self, shards):
+        updates = [
+            self._shard_updates[shard] for shard in shards
+            # Shards without objects stop polling after app launch
+            if self._objects[shard] or not self._launched
+        ]
+        if not updates or None in updates:
+            return None
+        return min(updates)
+
+    def set_update_listener(self, listener):
+        """
+        Set a callable invoked from the client thread when changes arrive
+        while none are pending. Later changes are merged into the pending
+        set until it is collected with pop_changed.
+        """
+        self._update_listener = listener
+        with self._changed_lock:
+            pending = self._changed_since is not None
+        if pending and listener is not None:
+            listener()
+
+    def pop_changed(self):
+        """
+        Return and reset the devices changed since the last call, when the
+        first of those changes arrived and how many updates carried them.
+        """
+        with self._changed_lock:
+            changed, self._changed = self._changed, set()
+            since, self._changed_since = self._changed_since, None
+            updates, self._changed_updates = self._changed_updates, 0
+        return changed, since, updates
+
+    @property
+    def running(self):
+        return not self._stopped.is_set()
+
     @property
     def structures(self):
         return self._storage.get(STRUCTURE)
@@ -126,103 +312,517 @@ class Nest(object):
     
     def where(self, id):
         return self._storage.get(WHERE, id)
+
+    def start(self):
+        """Start a subscribe loop per shard and their watchdog."""
+        if self.running:
+            return
+        self._stopped.clear()
+        for shard in range(len(self._shards)):
+            self._start_loop(shard)
+        self._start_thread('Nest subscribe watchdog', self._watchdog)
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Cancel the long-poll and wait up to timeout for threads to end."""
+        if not self.running:
+            return
+        deadline = time.monotonic() + timeout
+        self._stopped.set()
+        with self._loop_lock:
+            for shard in range(len(self._shards)):
+                self._generations[shard] += 1
+                self._cycle_started[shard] = None
+        # Fail the long-polls in flight, then wait for their threads
+        self._aborting = True
+        self._session.get_adapter(API_URL).abort()
+        self._session.close()
+        threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+            if thread.is_alive():
+                _LOGGER.warning('%s did not stop within %ss', thread.name, timeout)
+        self._session = self._poll_session()
+        self._aborting = False
+        # Let a write in progress finish rather than cutting it off
+        if self._write_lock.acquire(timeout=max(0, deadline - time.monotonic())):
+            self._write_lock.release()
+        else:
+            _LOGGER.warning('Write did not finish within %ss', timeout)
+
+    @staticmethod
+    def _poll_session():
+        session = requests.Session()
+        adapter = AbortableAdapter()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _start_thread(self, name, target, *args):
+        thread = threading.Thread(name=name, target=target, args=args, daemon=True)
+        self._threads = [t for t in self._threads if t.is_alive()] + [thread]
+        thread.start()
+
+    def _start_loop(self, shard):
+        with self._loop_lock:
+            self._generations[shard] += 1
+            self._cycle_started[shard] = None
+            generation = self._generations[shard]
+        self._start_thread(
+            f'Nest subscribe loop {shard}.{generation}', self._run, generation, shard)
+
+    def _run(self, generation, shard):
+        """Keep subscribing until superseded, backing off on failures."""
+        failures = 0
+        while generation == self._generations[shard] and self.running:
+            try:
+                self.update(generation, shard)
+            except (RateLimited, CircuitOpen) as e:
+                # Waiting on the host, logging in again won't help
+                if generation != self._generations[shard] or not self.running:
+                    break
+                self.stats['held_back'] += 1
+                self._stopped.wait(e.retry_after)
+            except Exception as e:
+                if generation != self._generations[shard] or not self.running:
+                    break
+                failures += 1
+                self.stats['failures'] += 1
+                delay = min(BACKOFF_MAX, BACKOFF_MIN * 2 ** (failures - 1))
+                delay *= random.uniform(1 - BACKOFF_JITTER, 1 + BACKOFF_JITTER)
+                _LOGGER.warning(
+                    'Failed to update (attempt %d), retrying in %.1fs: %s',
+                    failures, delay, e)
+                if failures % REAUTH_AFTER_FAILURES == 0:
+                    self._reauth()
+                self._stopped.wait(delay)
+            else:
+                failures = 0
+                if self._launched and not self._objects[shard]:
+                    _LOGGER.debug('Nothing to subscribe to in shard %d', shard)
+                    break
+                self._stopped.wait(POLL_INTERVAL)
+
+    def _watchdog(self):
+        """Restart a subscribe loop when its call hangs past the deadline."""
+        while not self._stopped.wait(WATCHDOG_INTERVAL):
+            for shard, started in enumerate(list(self._cycle_started)):
+                if started is None:
+                    continue
+                elapsed = time.monotonic() - started
+                # Past the read timeout an idle long-poll ends by itself
+                if elapsed > self._subscribe_timeout + CONNECT_TIMEOUT + WATCHDOG_INTERVAL:
+                    _LOGGER.warning(
+                        'Subscribe call for shard %d stalled for %.0fs, restarting',
+                        shard, elapsed)
+                    self.stats['watchdog_restarts'] += 1
+                    self._start_loop(shard)
+
+    def _reauth(self):
+        if self._reauthenticate is None:
+            return
+        try:
+            access_token, user_id, transport_url = self._reauthenticate()
+        except Exception as e:
+            _LOGGER.warning('Failed to log in again %s', e)
+            return
+        self.stats['reauthentications'] += 1
+        self._access_token = access_token
+        self._headers = None
+        self._user_id = user_id
+        self._transport_url = transport_url
+        self.dropcam = Dropcam(self._access_token, self._write_session)
     
-    def update(self):
+    def update(self, generation=None, shard=0):
+        changed = set()
+        self._cycle_started[shard] = time.monotonic()
+        updated = [shard]
         try:
-            has_objects = len(self._objects) > 0
-            uri = self._transport_url + ENDPOINT_SUBSCRIBE if has_objects else f"/api/0.1/user/{self._user_id}/app_launch"
-            _LOGGER.debug('update url %s', uri)
-            if len(self._objects) > 0:
-                body = {
-                    'objects': list(self._objects.values()),
-                }
+            if self._launched:
+                try:
+                    objects = self._subscribe(shard)
+                except requests.exceptions.ReadTimeout:
+                    # Nothing changed for the whole long-poll
+                    self.stats['idle_polls'] += 1
+                    objects = []
+                if generation is not None and generation != self._generations[shard]:
+                    _LOGGER.debug('Discarding response from superseded subscribe call')
+                    return
+                for received_object in self._in_scope(objects):
+                    self._apply_object(received_object, self._objects, changed)
             else:
-                body = {
-                    'known_bucket_types': list(BUCKETS.keys()),
-                    'known_bucket_versions': [],
-                }
-            response = self.post(
-                uri,
-                body,
-                has_objects == False
-            )
+                # Only switch to subscribing once the whole account is known.
+                # One shard launches, the others subscribe once it is done.
+                with self._launch_lock:
+                    if self._launched:
+                        return
+                    launched = [SubscribeBody() for _ in self._shards]
+                    for received_object in self._in_scope(self._app_launch()):
+                        if generation is not None and generation != self._generations[shard]:
+                            _LOGGER.debug('Discarding superseded app launch')
+                            return
+                        self._apply_object(received_object, launched, changed)
+                    self._objects = launched
+                    self._launched = True
+                    updated = range(len(self._shards))
+        finally:
+            if generation is None or generation == self._generations[shard]:
+                self._cycle_started[shard] = None
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for updated_shard in updated:
+            self._shard_updates[updated_shard] = now
+        self.stats['updates'] += 1
+        self._publish(changed)
+
+    def _publish(self, changed):
+        if changed:
+            with self._changed_lock:
+                notify = self._changed_since is None
+                if notify:
+                    self._changed_since = time.monotonic()
+                self._changed |= changed
+                self._changed_updates += 1
+            listener = self._update_listener
+            if notify and listener is not None:
+                listener()
+
+    def write(self, object_key, value):
+        """
+        Merge value into an object on the write connection, then fetch its
+        confirming revision instead of waiting for the long-poll.
+        """
+        with self._write_lock:
+            # The revision the write starts from, the long-poll may have
+            # moved past it by the time the write returns
+            shard = self._shard_of.get(object_key.partition('.')[0], -1)
+            previous = self._objects[shard].get(object_key)
+            self._pending_writes.setdefault(object_key, time.monotonic())
+            self.stats['writes'] += 1
+            body = {'objects': [
+                {'object_key': object_key, 'op': 'MERGE', 'value': value},
+            ]}
+            try:
+                response = self.post(
+                    self._transport_url + ENDPOINT_PUT, body, False,
+                    session=self._write_session, timeout=WRITE_TIMEOUT,
+                    kind=WRITE)
+            except Exception as e:
+                self._pending_writes.pop(object_key, None)
+                self.stats['write_failures'] += 1
+                raise APIError(f'Failed to write {object_key}') from e
+            if response is None:
+                self._pending_writes.pop(object_key, None)
+                self.stats['write_failures'] += 1
+                raise APIError(f'Invalid response writing {object_key}')
+            try:
+                self._confirm_write(object_key, shard, previous, response)
+            except Exception as e:
+                # The long-poll picks the new revision up in any case
+                _LOGGER.debug('Failed to confirm write to %s %s', object_key, e)
+
+    async def async_set_camera_properties(self, uuids, properties):
+        """Set Dropcam properties on many cameras and apply them locally."""
+        updated = await self.dropcam.async_set_properties(uuids, properties)
+        data = {}
+        for name, value in properties.items():
+            to_fields = DROPCAM_PROPERTY_FIELDS.get(name)
+            if to_fields is not None:
+                data.update(to_fields(value))
+        changed = set()
+        for camera_id in updated:
+            camera = self._storage.find(CAMERA, camera_id)
+            if data and camera is not None and camera.set(data):
+                changed.add(camera)
+        self._publish(changed)
+        return updated
+
+    def _confirm_write(self, object_key, shard, previous, response):
+        """Fetch the revision following previous, unless there is none to wait for."""
+        if previous is None:
+            return
+        written = next((
+            written for written in response.get('objects') or ()
+            if written.get('object_key') == object_key
+        ), None)
+        if written is not None and written.get('object_revision') == previous['object_revision']:
+            # The write changed nothing, no new revision is coming
+            self._pending_writes.pop(object_key, None)
+            self.stats['writes_unchanged'] += 1
+            return
+        if self._objects[shard].get(object_key) is not previous:
+            # The long-poll has already applied a newer revision
+            return
+        response = self.post(
+            self._transport_url + ENDPOINT_SUBSCRIBE, {'objects': [previous]},
+            False, session=self._write_session, timeout=WRITE_TIMEOUT,
+            kind=WRITE)
+        if response is None or 'objects' not in response:
+            return
+        changed = set()
+        for received_object in response['objects']:
+            self._apply_object(received_object, self._objects, changed)
+        self._publish(changed)
+
+    def _subscribe(self, shard):
+        uri = self._transport_url + ENDPOINT_SUBSCRIBE
+        _LOGGER.debug('update url %s shard %d', uri, shard)
+        response = self.post(uri, self._objects[shard].payload, False)
+        if response is None or 'objects' not in response:
+            raise APIError('Invalid response from update. Key not found')
+        _LOGGER.debug('update response %s', response['objects'])
+        return response['objects']
+
+    def _app_launch(self):
+        uri = f"/api/0.1/user/{self._user_id}/app_launch"
+        _LOGGER.debug('update url %s', uri)
+        body = {
+            'known_bucket_types': sorted(self._buckets),
+            'known_bucket_versions': [],
+        }
+        if not self._stream_app_launch:
+            response = self.post(uri, body)
+            if response is None or 'updated_buckets' not in response:
+                raise APIError('Invalid response from update. Key not found')
+            return response['updated_buckets']
+        return self._stream_post(uri, body, 'updated_buckets')
+
+    def _in_scope(self, received_objects):
+        """
+        Drop objects belonging to structures that aren't configured. Objects
+        are passed on as soon as their structure is known, the others once
+        the batch has been received.
+        """
+        if self._structure_names is None:
+            yield from received_objects
+            return
+        # Devices name their structure in link and quartz, which may arrive
+        # after the device itself, so hold those back until then
+        pending = []
+        for received_object in received_objects:
+            if self._learn_structure(received_object):
+                waiting, pending = pending + [received_object], []
+            else:
+                waiting = [received_object]
+            for waiting_object in waiting:
+                in_scope = self._structure_in_scope(waiting_object['object_key'])
+                if in_scope is None:
+                    pending.append(waiting_object)
+                elif in_scope:
+                    yield waiting_object
+                else:
+                    self.stats['out_of_scope_objects'] += 1
+        for received_object in pending:
+            structure_id = self._object_structure_id(received_object['object_key'])
+            if structure_id is None or structure_id in self._local_structures:
+                yield received_object
+            else:
+                self.stats['out_of_scope_objects'] += 1
+
+    def _structure_in_scope(self, object_key):
+        """Return whether an object is in scope, None while that is unknown."""
+        structure_id = self._object_structure_id(object_key)
+        if structure_id in self._local_structures:
+            return True
+        if structure_id in self._foreign_structures:
+            return False
+        return None
+
+    def _learn_structure(self, received_object):
+        """Note what an object says about structures, return whether anything."""
+        bucket, _, udid = received_object['object_key'].partition('.')
+        value = received_object.get('value') or {}
+        if bucket == 'structure':
+            if 'name' not in value:
+                # Partial update, e.g. away, says nothing about the name
+                return False
+            if value['name'] in self._structure_names:
+                self._local_structures.add(udid)
+                self._foreign_structures.discard(udid)
+            else:
+                self._local_structures.discard(udid)
+                self._foreign_structures.add(udid)
+        elif bucket == 'link' and value.get('structure'):
+            self._device_structures[udid] = value['structure'].partition('.')[2]
+        elif bucket == 'quartz' and value.get('structure_id'):
+            self._device_structures[udid] = value['structure_id']
+        else:
+            return False
+        return True
 
-            if 'updated_buckets' in response:
-                objects = response['updated_buckets']
-
-            if 'objects' in response:
-                objects = response['objects']
-            
-            if not objects:
-                _LOGGER.warning('Invalid response from update. Key not found')
-
-            _LOGGER.debug('update response %s', objects)
-
-            for received_object in objects:
-                self._objects[received_object['object_key']] = {
-                    'object_key': received_object['object_key'],
-                    'object_revision': received_object['object_revision'],
-                    'object_timestamp': received_object['object_timestamp']
-                }
-                sensor_data = received_object['value']
-                for bucket in BUCKETS.keys():
-                    if received_object['object_key'].startswith(f"{bucket}."):
-                        udid = received_object['object_key'].replace(f"{bucket}.", "")
-                        item_type = BUCKETS[bucket]
-                        item = self._storage.get(item_type, udid)
-                        if item is None:
-                            item = nest_object(item_type, udid, sensor_data, self)
-                            _LOGGER.info('Adding device %s %s %s', item_type, udid, item)
-                            self._storage.add(item_type, udid, item)
-                        else:
-                            _LOGGER.debug('updating device %s %s %s', item_type, udid, sensor_data)
-                            item.set(sensor_data)
-            
-            self._update_event.set()
-            
-            timer = Timer(1, self.update)
-            timer.start()
-        except Exception as e:
-            _LOGGER.debug('Failed to update, trying to log in again %s', e)
+    def _object_structure_id(self, object_key):
+        bucket, _, udid = object_key.partition('.')
+        if bucket in ('structure', 'where'):
+            # where buckets are keyed by their structure
+            return udid
+        return self._device_structures.get(udid)
+
+    def _apply_object(self, received_object, objects, changed):
+        bucket, _, udid = received_object['object_key'].partition('.')
+        handler = BUCKET_HANDLERS.get(bucket)
+        if handler is None or bucket not in self._buckets:
+            # Buckets we don't model (topaz, kryptonite...) or don't need
+            # are neither stored nor subscribed to
+            self.stats['dropped_objects'] += 1
+            return
+        object_key = sys.intern(received_object['object_key'])
+        objects[self._shard_of.get(bucket, -1)].set(
+            object_key,
+            received_object['object_revision'],
+            received_object['object_timestamp'],
+        )
+        written = self._pending_writes.pop(object_key, None)
+        if written is not None:
+            latency = int((time.monotonic() - written) * 1000)
+            self.stats['write_latency_ms'] = latency
+            self.stats['write_latency_max_ms'] = max(
+                self.stats['write_latency_max_ms'], latency)
+        sensor_data = received_object['value']
+        item_type, cls = handler
+        udid = sys.intern(udid)
+        item = self._storage.find(item_type, udid)
+        if item is None:
+            item = cls(udid, sensor_data, self)
+            _LOGGER.info('Adding device %s %s %s', item_type, udid, item)
+            self._storage.add(item_type, udid, item)
+        else:
+            _LOGGER.debug('updating device %s %s %s', item_type, udid, sensor_data)
+            if not item.set(sensor_data):
+                return
+        changed.add(item)
     
     def get(self, path):
         try:
-            response = requests.get(f"{API_URL}{path}", headers=self._default_headers())
+            response = scheduler.request(
+                POLL, 'get', f"{API_URL}{path}", headers=self._default_headers(),
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
             return self._handle_response(response)
         except requests.exceptions.RequestException as e:
             _LOGGER.error(e)
     
-    def post(self, path, data, prefix_url = True):
+    def post(self, path, data, prefix_url = True, session=None, timeout=None,
+             kind=POLL):
         if prefix_url:
             url = API_URL + path
         else:
             url = path
         try:
-            response = requests.post(url, json=data, headers=self._default_headers())
+            response = scheduler.request(
+                kind, 'post', url, session=session or self._session,
+                data=data if isinstance(data, bytes) else codec.dumps(data),
+                headers=self._default_headers(),
+                timeout=(CONNECT_TIMEOUT, timeout or self._subscribe_timeout),
+            )
             return self._handle_response(response)
         except Exception as e:
-            _LOGGER.error('Failed to make request %s', e)
+            if self._aborting:
+                # Cut off by stop()
+                _LOGGER.debug('Request aborted %s', e)
+            elif kind == POLL and isinstance(e, requests.exceptions.ReadTimeout):
+                _LOGGER.debug('Long-poll idle until timeout %s', e)
+            else:
+                _LOGGER.error('Failed to make request %s', e)
+            raise e
+
+    def _stream_post(self, path, data, key):
+        """Yield the items of the array under key as they are received."""
+        try:
+            with scheduler.request(
+                POLL, 'post', API_URL + path, session=self._session,
+                data=codec.dumps(data),
+                headers=self._default_headers(),
+                timeout=(CONNECT_TIMEOUT, self._subscribe_timeout),
+                stream=True,
+            ) as response:
+                yield from codec.iter_items(
+                    response.iter_content(STREAM_CHUNK_SIZE), key)
+        except KeyError:
+            raise APIError('Invalid response from update. Key not found')
+        except Exception as e:
+            if self._aborting:
+                # Cut off by stop()
+                _LOGGER.debug('Request aborted %s', e)
+            else:
+                _LOGGER.error('Failed to make request %s', e)
             raise e
     
     def _handle_response(self, response):
         try:
-            return response.json()
-        except json.JSONDecodeError as e:
+            return codec.loads(response.content)
+        except codec.JSONDecodeError as e:
             _LOGGER.error("Failed to decode JSON %s %s", response.text, e)
     
     def _default_headers(self):
-        return {
-            "Authorization": f"Basic {self._access_token}",
-            "User-Agent": USER_AGENT
-        }
+        # Cached until the access token changes
+        if self._headers is None:
+            self._headers = {
+                "Authorization": f"Basic {self._access_token}",
+                "User-Agent": USER_AGENT,
+                "Content-Type": "application/json",
+            }
+        return self._headers
                     
+class SubscribeBody(object):
+    """
+    The objects list sent to /v5/subscribe, updated one object at a time.
+    The encoded body is cached until an object revision changes. Writes
+    and the encoding are serialized, lookups don't lock.
+    """
+    def __init__(self):
+        self._objects = []
+        self._index = {}
+        self._payload = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __iter__(self):
+        return iter(self._objects)
+
+    def set(self, object_key, revision, timestamp):
+        entry = {
+            'object_key': object_key,
+            'object_revision': revision,
+            'object_timestamp': timestamp,
+        }
+        with self._lock:
+            position = self._index.get(object_key)
+            if position is None:
+                # The entry is in place before its index points at it
+                self._objects.append(entry)
+                self._index[object_key] = len(self._objects) - 1
+            else:
+                current = self._objects[position]
+                if (current['object_revision'] == revision and
+                        current['object_timestamp'] == timestamp):
+                    return
+                self._objects[position] = entry
+            self._payload = None
+
+    def get(self, object_key):
+        position = self._index.get(object_key)
+        return None if position is None else self._objects[position]
+
+    @property
+    def payload(self):
+        with self._lock:
+            if self._payload is None:
+                self._payload = codec.dumps({'objects': self._objects})
+            return self._payload
+
 class Storage(object):
+    """
+    Devices by type and id. Additions publish a new mapping instead of
+    changing the current one, so readers in other threads never lock.
+    """
     def __init__(self):
         self._items = {}
+        self._lock = threading.Lock()
     
     def get(self, type, id = None):
-        if type in self._items:
-            list = self._items[type]
+        items = self._items
+        if type in items:
+            list = items[type]
         else:
             list = {}
         if id is None:
@@ -231,24 +831,164 @@ class Storage(object):
             return list[id]
         else:
             _LOGGER.error("Failed to find device with ID %s %s", type, id)
+
+    def find(self, type, id):
+        return self._items.get(type, {}).get(id)
     
     def add(self, type, id, item):
-        if type not in self._items:
-            self._items[type] = {}
-        self._items[type][id] = item
+        with self._lock:
+            items = dict(self._items)
+            items[type] = {**items.get(type, {}), id: item}
+            self._items = items
+
+_MISSING = object()
+# Strings up to this length are treated as enum-like values and interned
+INTERN_MAX_LENGTH = 64
+
+def intern_value(value):
+    """Intern short strings and the keys of nested dicts and lists."""
+    if isinstance(value, str):
+        return sys.intern(value) if len(value) <= INTERN_MAX_LENGTH else value
+    if isinstance(value, dict):
+        return {
+            sys.intern(k) if isinstance(k, str) else k: intern_value(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [intern_value(v) for v in value]
+    return value
+
+class Record(object):
+    """
+    Compact, immutable store for the bucket fields a device class reads.
+    Subclasses list the projected fields in __slots__; anything else in a
+    payload is dropped. Supports the read-only dict methods the device
+    properties use. Updates produce a new record via merged().
+    """
+    __slots__ = ()
+    _fields = frozenset()
+
+    def __init__(self, data=None):
+        if data:
+            self._apply(self, data)
+
+    def _apply(self, target, data):
+        for key in self.__slots__:
+            value = data.get(key, _MISSING)
+            if value is _MISSING:
+                continue
+            current = getattr(self, key, _MISSING)
+            # Keep the stored object when nothing changed, so unchanged
+            # nested values are shared rather than replaced every update
+            if type(current) is type(value) and current == value:
+                continue
+            if target is None:
+                target = self._copy()
+            setattr(target, key, intern_value(value))
+        return target
+
+    def _copy(self):
+        record = self.__class__()
+        for key in self.__slots__:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                setattr(record, key, value)
+        return record
+
+    def merged(self, data):
+        """Return a record with data applied, or self if nothing changed."""
+        return self._apply(None, data) or self
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self._fields else default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__ if hasattr(self, key)}
+
+    def __repr__(self):
+        return str(self.as_dict())
+
+def record_type(name, fields):
+    fields = tuple(sorted(set(fields)))
+    return type(name, (Record,), {'__slots__': fields, '_fields': frozenset(fields)})
 
 class NestBase(object):
+    # Bucket fields kept for this class, None keeps the payload as given
+    FIELDS = None
+
     def __init__(self, id, data, nest_api):
         self._id = id
-        self._data = data
         self._nest_api = nest_api
+        self._raw = None
+        # Serializes writers, readers never take it
+        self._set_lock = threading.Lock()
+        if self.FIELDS is None:
+            self._data = data
+        else:
+            self._data = self._record_type()(data)
+            if getattr(nest_api, 'keep_raw', False):
+                self._raw = dict(data)
         _LOGGER.debug('base %s', data)
 
+    @classmethod
+    def _record_type(cls):
+        record = cls.__dict__.get('_record')
+        if record is None:
+            record = record_type(f'{cls.__name__}Record', cls.FIELDS)
+            cls._record = record
+        return record
+
     def __str__(self):
         return '<%s: %s>' % (self.__class__.__name__, self._id)
 
     def set(self, data):
-        self._data.update(data)
+        """
+        Publish a new revision of the device data and return whether it
+        changed. The previous revision is left untouched for readers, and
+        concurrent writers are applied one after the other.
+        """
+        with self._set_lock:
+            if self.FIELDS is None:
+                self._data = {**self._data, **data}
+                return True
+            if self._raw is not None:
+                self._raw = {**self._raw, **data}
+            previous = self._data
+            self._data = previous.merged(data)
+            return self._data is not previous
+
+    def snapshot(self):
+        """Return a copy pinned to the current revision of the data."""
+        return copy.copy(self)
+
+    def _set(self, what, data):
+        """
+        Write data to this object's buckets, given a legacy API path. Nothing
+        is written if any field has no known web API equivalent.
+        """
+        writes = {}
+        for field, value in data.items():
+            mapping = WRITE_FIELDS.get((what, field))
+            if mapping is None:
+                raise NotImplementedError(f"Setting {field} is not supported")
+            bucket, name, to_web = mapping
+            writes.setdefault(bucket, {})[name] = value if to_web is None else to_web(value)
+        for target, value in writes.items():
+            self._nest_api.write(f'{target}.{self._id}', value)
+
+    @property
+    def raw(self):
+        """Full merged payload, only kept when the client keeps raw data."""
+        return self._raw
 
     @property
     def _weather(self):
@@ -274,25 +1014,28 @@ class NestBase(object):
         return self.serial
 
 class Where(NestBase):
+    FIELDS = ('wheres',)
+
     @classmethod
     def is_handler_for(self, type):
         return type == WHERE
 
-    def __init__(self, id, data, nest_api):
-        super().__init__(id, data, nest_api)
-        self._wheres = {}
-        for where in data['wheres']:
-            self._wheres[where['where_id']] = where['name']
-    
     @property
     def wheres(self):
         return self._data.get('wheres')
     
     def where(self, where_id):
-        if where_id in self._wheres:
-            return self._wheres[where_id]
+        # Read from the current revision, so renames show up
+        for where in self.wheres or ():
+            if where['where_id'] == where_id:
+                return where['name']
 
 class Device(NestBase):
+    FIELDS = (
+        'device_id', 'is_online', 'name', 'name_long', 'software_version',
+        'structure_id', 'where_id',
+    )
+
     @classmethod
     def is_handler_for(self, type):
         return False
@@ -347,11 +1090,20 @@ class Device(NestBase):
     @property
     def where(self):
         if self.where_id is not None:
-            wheres = self._nest_api.wheres
-            if len(wheres) > 0:
-                where = list(wheres)[0]
+            where = self.where_bucket
+            if where is not None:
                 return where.where(self.where_id)
 
+    @property
+    def where_bucket(self):
+        """The where bucket naming the rooms of this device's structure."""
+        wheres = self._nest_api.wheres
+        structure_id = self.structure_id
+        for where in wheres:
+            if where.id == structure_id:
+                return where
+        return next(iter(wheres), None)
+
     @property
     def where_id(self):
         return self._data.get('where_id')
@@ -385,6 +1137,21 @@ class Device(NestBase):
 
 
 class Thermostat(Device):
+    FIELDS = Device.FIELDS + (
+        'can_cool', 'can_heat', 'current_temperature',
+        'eco_temperature_high_c', 'eco_temperature_high_f',
+        'eco_temperature_low_c', 'eco_temperature_low_f',
+        'fan_timer_active', 'fan_timer_duration', 'has_dehumidifier',
+        'has_fan', 'has_hot_water_control', 'has_humidifier', 'has_leaf',
+        'hot_water_temperature', 'humidity', 'hvac_state', 'is_locked',
+        'is_using_emergency_heat', 'label', 'last_connection',
+        'locked_temp_max_c', 'locked_temp_max_f', 'locked_temp_min_c',
+        'locked_temp_min_f', 'previous_hvac_mode', 'structure',
+        'target_temperature', 'target_temperature_high',
+        'target_temperature_low', 'target_temperature_type',
+        'temperature_scale', 'time_to_target', 'time_to_target_training',
+    )
+
     @classmethod
     def is_handler_for(self, type):
         return type == THERMOSTAT
@@ -419,7 +1186,9 @@ class Thermostat(Device):
     @property
     def structure_id(self):
         # Thermo stat structure is given through its link bucket, not the standard structure_id
-        return self._data.get('structure').replace('structure.', '')
+        structure = self._data.get('structure')
+        if structure is not None:
+            return structure.replace('structure.', '')
 
     @fan.setter
     def fan(self, value):
@@ -475,7 +1244,8 @@ class Thermostat(Device):
 
     @property
     def mode(self):
-        return self._data.get('target_temperature_type')
+        mode = self._data.get('target_temperature_type')
+        return HVAC_MODES_FROM_WEB.get(mode, mode)
 
     @mode.setter
     def mode(self, value):
@@ -575,8 +1345,10 @@ class Thermostat(Device):
         return self.structure.postal_code
         # return self._data['postal_code']
 
-    def _temp_key(self, key):
-        return "%s_%s" % (key, self.temperature_scale.lower())
+    def _temp_key(self, key, data=None):
+        if data is None:
+            data = self._data
+        return "%s_%s" % (key, data.get('temperature_scale').lower())
 
     def _round_temp(self, temp):
         if self.temperature_scale == 'C':
@@ -599,8 +1371,9 @@ class Thermostat(Device):
 
     @property
     def locked_temperature(self):
-        low = self._data.get(self._temp_key('locked_temp_min'))
-        high = self._data.get(self._temp_key('locked_temp_max'))
+        data = self._data
+        low = data.get(self._temp_key('locked_temp_min', data))
+        high = data.get(self._temp_key('locked_temp_max', data))
         return LowHighTuple(low, high)
 
     @property
@@ -633,12 +1406,13 @@ class Thermostat(Device):
 
     @property
     def target(self):
-        if self.mode == 'heat-cool':
-            low = self._data.get('target_temperature_low')
-            high = self._data.get('target_temperature_high')
+        data = self._data
+        if data.get('target_temperature_type') == HVAC_MODES_TO_WEB['heat-cool']:
+            low = data.get('target_temperature_low')
+            high = data.get('target_temperature_high')
             return LowHighTuple(low, high)
 
-        return self._data.get('target_temperature')
+        return data.get('target_temperature')
 
     @target.setter
     def target(self, value):
@@ -671,8 +1445,9 @@ class Thermostat(Device):
     @property
     def eco_temperature(self):
         # use get, since eco_temperature isn't always filled out
-        low = self._data.get(self._temp_key('eco_temperature_low'))
-        high = self._data.get(self._temp_key('eco_temperature_high'))
+        data = self._data
+        low = data.get(self._temp_key('eco_temperature_low', data))
+        high = data.get(self._temp_key('eco_temperature_high', data))
 
         return LowHighTuple(low, high)
 
@@ -753,6 +1528,12 @@ class Thermostat(Device):
 
 
 class SmokeCoAlarm(Device):
+    FIELDS = Device.FIELDS + (
+        'battery_health', 'co_alarm_state', 'last_manual_test_time',
+        'product_id', 'smoke_alarm_state', 'smoke_sequence_number',
+        'ui_color_state',
+    )
+
     @property
     def is_smoke_co_alarm(self):
         return True
@@ -1040,6 +1821,12 @@ class SmokeCoAlarm(Device):
         # return self._data['wired_or_battery']
 
 class Camera(Device):
+    FIELDS = Device.FIELDS + (
+        'activity_zones', 'is_audio_input_enabled', 'is_public_share_enabled',
+        'is_video_history_enabled', 'last_event', 'model', 'snapshot_url',
+        'streaming_state', 'web_url',
+    )
+
     @classmethod
     def is_handler_for(self, type):
         return type == CAMERA
@@ -1299,6 +2086,12 @@ class Camera(Device):
         return self._data.get('web_url')
 
 class Structure(NestBase):
+    FIELDS = (
+        'away', 'country_code', 'eta_begin', 'name', 'peak_period_end_time',
+        'peak_period_start_time', 'postal_code', 'time_zone', 'wheres',
+        'wwn_security_state',
+    )
+
     @classmethod
     def is_handler_for(self, type):
         return type == STRUCTURE
@@ -1311,7 +2104,9 @@ class Structure(NestBase):
 
     @property
     def away(self):
-        return self._data.get('away')
+        # The web API keeps a boolean, the legacy API said away or home
+        away = self._data.get('away')
+        return away if away is None else AWAY_MAP[bool(away)]
 
     @away.setter
     def away(self, value):
@@ -1705,4 +2500,18 @@ class CameraEvent(NestBase):
 
     def has_ongoing_person(self):
         if self.is_ongoing:
-            return self.has_person
\ No newline at end of file
+            return self.has_person
+
+
+HANDLERS = {
+    THERMOSTAT: Thermostat,
+    CAMERA: Camera,
+    STRUCTURE: Structure,
+    WHERE: Where,
+}
+
+# Bucket name -> (storage type, handler class)
+BUCKET_HANDLERS = {
+    bucket: (item_type, HANDLERS[item_type])
+    for bucket, item_type in BUCKETS.items()
+}
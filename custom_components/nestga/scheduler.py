@@ -0,0 +1,254 @@
+"""Shared rate limiting and circuit breaking for the Nest endpoints."""
+import collections
+import email.utils
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from .const import CONNECT_TIMEOUT, READ_TIMEOUT
+
+_LOGGER = logging.getLogger(__name__)
+
+# Endpoint classes, in priority order
+AUTH = 'auth'
+WRITE = 'write'
+SNAPSHOT = 'snapshot'
+POLL = 'poll'
+
+PRIORITIES = {AUTH: 0, WRITE: 1, SNAPSHOT: 2, POLL: 3}
+
+# Requests per second and burst, for a whole host and per endpoint class
+HOST_LIMIT = (5, 10)
+LIMITS = {
+    AUTH: (0.1, 3),
+    WRITE: (2, 5),
+    SNAPSHOT: (1, 3),
+    POLL: (2, 4),
+}
+
+# Seconds to hold a host back after a 429 without Retry-After, and at most
+RETRY_AFTER_DEFAULT = 30
+RETRY_AFTER_MAX = 300
+# Consecutive failures that open a host's circuit, and seconds between
+# probes while it is open
+FAILURE_THRESHOLD = 5
+PROBE_INTERVAL = 30
+
+
+class RateLimited(requests.exceptions.HTTPError):
+    """The host asked us to slow down."""
+
+    def __init__(self, message, retry_after, response=None):
+        super().__init__(message, response=response)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(requests.exceptions.ConnectionError):
+    """The host is failing, requests to it are refused until a probe succeeds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker(object):
+    """
+    Refuse requests to a host after repeated failures. While open, one
+    probe request is let through every probe interval.
+    """
+    def __init__(self, threshold=FAILURE_THRESHOLD, probe_interval=PROBE_INTERVAL):
+        self._threshold = threshold
+        self._probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened = None
+        self._probing = False
+
+    def before(self, host):
+        """Raise CircuitOpen unless a request to host may go out."""
+        with self._lock:
+            if self._opened is None:
+                return
+            wait = self._opened + self._probe_interval - time.monotonic()
+            if wait <= 0 and not self._probing:
+                self._probing = True
+                return
+        raise CircuitOpen(f'{host} is unavailable', max(1, wait))
+
+    def released(self):
+        """Let the next probe out without counting the request either way."""
+        with self._lock:
+            self._probing = False
+
+    def succeeded(self):
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+            self._probing = False
+
+    def failed(self):
+        """Record a failure and return whether it opened the circuit."""
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            opening = self._opened is None and self._failures >= self._threshold
+            if opening or self._opened is not None:
+                self._opened = time.monotonic()
+            return opening
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def delay(self, now, tokens=1):
+        """Seconds until tokens are available."""
+        self._refill(now)
+        return max(0, (min(tokens, self._burst) - self._tokens) / self._rate)
+
+    def take(self):
+        self._tokens -= 1
+
+
+class Scheduler(object):
+    """
+    Hand out request slots per host and endpoint class. Waiting requests
+    of a higher priority class hold back host slots from lower ones.
+    """
+    def __init__(self, limits=LIMITS, host_limit=HOST_LIMIT):
+        self._limits = limits
+        self._host_limit = host_limit
+        self._condition = threading.Condition()
+        self._buckets = {}
+        self._waiting = collections.Counter()
+        self._blocked_until = {}
+        self._breakers = {}
+        self.stats = collections.Counter()
+
+    def breaker(self, host):
+        with self._condition:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker()
+            return breaker
+
+    def _bucket(self, host, kind=None):
+        bucket = self._buckets.get((host, kind))
+        if bucket is None:
+            limit = self._host_limit if kind is None else self._limits[kind]
+            bucket = self._buckets[host, kind] = TokenBucket(*limit)
+        return bucket
+
+    def acquire(self, host, kind):
+        """Block until a request of kind may be sent to host."""
+        priority = PRIORITIES[kind]
+        started = time.monotonic()
+        with self._condition:
+            self._waiting[host, priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    ahead = sum(
+                        self._waiting[host, higher] for higher in range(priority))
+                    delay = max(
+                        self._blocked_until.get(host, now) - now,
+                        self._bucket(host, kind).delay(now),
+                        self._bucket(host).delay(now, 1 + ahead),
+                    )
+                    if delay <= 0:
+                        self._bucket(host, kind).take()
+                        self._bucket(host).take()
+                        break
+                    self._condition.wait(delay)
+            finally:
+                self._waiting[host, priority] -= 1
+                self._condition.notify_all()
+        waited = int((time.monotonic() - started) * 1000)
+        self.stats[f'requests_{kind}'] += 1
+        if waited:
+            self.stats[f'wait_{kind}_ms'] += waited
+
+    def defer(self, host, seconds):
+        """Hold back every request to host for seconds."""
+        with self._condition:
+            until = time.monotonic() + seconds
+            self._blocked_until[host] = max(self._blocked_until.get(host, 0), until)
+            self._condition.notify_all()
+
+    def request(self, kind, method, url, session=None, **kwargs):
+        """
+        Send a request once the scheduler allows it. A 429, or a 503 with
+        Retry-After, holds the host back and raises RateLimited. Connection
+        errors and server errors count towards opening the host's circuit,
+        after which CircuitOpen is raised without calling the host. Read
+        timeouts don't count either way.
+        """
+        host = urlsplit(url).hostname
+        kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+        breaker = self.breaker(host)
+        try:
+            breaker.before(host)
+        except CircuitOpen:
+            self.stats['circuit_rejected'] += 1
+            raise
+        try:
+            self.acquire(host, kind)
+            response = (session or requests).request(method, url, **kwargs)
+        except requests.exceptions.ReadTimeout:
+            # The host answered the connection, it just had nothing to say,
+            # as an idle long-poll does
+            breaker.released()
+            raise
+        except BaseException:
+            # Whatever went wrong, a probe must not stay outstanding
+            self._failed(host, breaker)
+            raise
+        throttled = response.status_code == 429 or (
+                response.status_code == 503 and 'Retry-After' in response.headers)
+        if response.status_code >= 500 and not throttled:
+            self._failed(host, breaker)
+        else:
+            breaker.succeeded()
+        if throttled:
+            retry_after = min(RETRY_AFTER_MAX, _retry_after(response))
+            self.stats['rate_limited'] += 1
+            _LOGGER.warning('%s rate limited, holding back for %.0fs', host, retry_after)
+            self.defer(host, retry_after)
+            response.close()
+            raise RateLimited(
+                f'{host} rate limited for {retry_after:.0f}s', retry_after, response)
+        return response
+
+    def _failed(self, host, breaker):
+        if breaker.failed():
+            self.stats['circuit_opened'] += 1
+            _LOGGER.warning('%s keeps failing, holding requests back', host)
+
+
+def _retry_after(response):
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return RETRY_AFTER_DEFAULT
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return RETRY_AFTER_DEFAULT
+    return max(0, when.timestamp() - time.time())
+
+
+scheduler = Scheduler()
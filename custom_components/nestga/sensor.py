@@ -1,5 +1,6 @@
 """Support for Nest Thermostat sensors."""
 import logging
+import time
 
 from homeassistant.const import (
     CONF_MONITORED_CONDITIONS,
@@ -8,10 +9,31 @@ from homeassistant.const import (
     STATE_OFF,
     TEMP_CELSIUS,
     TEMP_FAHRENHEIT,
+    TIME_SECONDS,
     UNIT_PERCENTAGE,
 )
 
-from . import CONF_SENSORS, DATA_NEST, DATA_NEST_CONFIG, NestSensorDevice
+from homeassistant.core import callback
+from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.event import async_call_later, async_track_time_interval
+from homeassistant.util.dt import utcnow
+
+from . import (
+    ATTR_LAST_UPDATE,
+    CONF_DEADBAND,
+    CONF_MAX_SILENCE,
+    CONF_MIN_INTERVAL,
+    CONF_SENSORS,
+    CONF_THROTTLE,
+    DATA_NEST,
+    DATA_NEST_CONFIG,
+    DOMAIN,
+    FRESHNESS_INTERVAL,
+    NestSensorDevice,
+    state_fingerprint,
+)
+from .executor import executor, write_executor
+from .scheduler import scheduler
 
 SENSOR_TYPES = ["humidity", "operation_mode", "hvac_state"]
 
@@ -81,11 +103,13 @@ async def async_setup_entry(hass, entry, async_add_entities):
     discovery_info = hass.data.get(DATA_NEST_CONFIG, {}).get(CONF_SENSORS, {})
 
     # Add all available sensors if no Nest sensor config is set
-    if discovery_info == {}:
+    if CONF_MONITORED_CONDITIONS not in discovery_info:
         conditions = _VALID_SENSOR_TYPES
     else:
         conditions = discovery_info.get(CONF_MONITORED_CONDITIONS, {})
 
+    throttles = discovery_info.get(CONF_THROTTLE, {})
+
     for variable in conditions:
         if variable in _SENSOR_TYPES_DEPRECATED:
             if variable in DEPRECATED_WEATHER_VARS:
@@ -108,7 +132,7 @@ async def async_setup_entry(hass, entry, async_add_entities):
         all_sensors = []
         for structure in nest.structures():
             all_sensors += [
-                NestBasicSensor(structure, None, variable, nest)
+                NestBasicSensor(structure, None, variable, nest, throttles.get(variable))
                 for variable in conditions
                 if variable in STRUCTURE_SENSOR_TYPES
             ]
@@ -116,19 +140,19 @@ async def async_setup_entry(hass, entry, async_add_entities):
         for device in nest.thermostats():
             structure = device.structure
             all_sensors += [
-                NestBasicSensor(structure, device, variable, nest)
+                NestBasicSensor(structure, device, variable, nest, throttles.get(variable))
                 for variable in conditions
                 if variable in SENSOR_TYPES
             ]
             all_sensors += [
-                NestTempSensor(structure, device, variable, nest)
+                NestTempSensor(structure, device, variable, nest, throttles.get(variable))
                 for variable in conditions
                 if variable in TEMP_SENSOR_TYPES
             ]
 
         for structure, device in nest.smoke_co_alarms():
             all_sensors += [
-                NestBasicSensor(structure, device, variable, nest)
+                NestBasicSensor(structure, device, variable, nest, throttles.get(variable))
                 for variable in conditions
                 if variable in PROTECT_SENSOR_TYPES
             ]
@@ -138,17 +162,110 @@ async def async_setup_entry(hass, entry, async_add_entities):
             structures_has_camera[device.structure] = True
         for structure in structures_has_camera:
             all_sensors += [
-                NestBasicSensor(structure, None, variable, nest)
+                NestBasicSensor(structure, None, variable, nest, throttles.get(variable))
                 for variable in conditions
                 if variable in STRUCTURE_CAMERA_SENSOR_TYPES
             ]
 
+        all_sensors.append(NestClientSensor(nest))
+
         return all_sensors
 
     async_add_entities(await hass.async_add_job(get_sensors), True)
 
 
-class NestBasicSensor(NestSensorDevice):
+class NestThrottledSensor(NestSensorDevice):
+    """Representation of a Nest sensor with optional publish throttling."""
+
+    def __init__(self, structure, device, variable, nest, throttle=None):
+        """Initialize the sensor."""
+        super().__init__(structure, device, variable, nest)
+        throttle = throttle or {}
+        self._deadband = throttle.get(CONF_DEADBAND, 0)
+        self._min_interval = throttle.get(CONF_MIN_INTERVAL)
+        self._max_silence = throttle.get(CONF_MAX_SILENCE)
+        self._published_state = None
+        self._published_at = None
+        self._cancel_trailing = None
+
+    def should_publish(self):
+        """
+        Hold back changes inside the deadband or the minimum interval. Changes
+        held back by the interval are written once it has passed.
+        """
+        now = time.monotonic()
+        state = self._state
+        published = self._published_state
+        if self._published_at is not None:
+            elapsed = now - self._published_at
+            silent_too_long = (
+                self._max_silence is not None
+                and elapsed >= self._max_silence.total_seconds()
+            )
+            if not silent_too_long:
+                if (
+                    self._min_interval is not None
+                    and elapsed < self._min_interval.total_seconds()
+                ):
+                    self._schedule_trailing(self._min_interval.total_seconds() - elapsed)
+                    return False
+                if (
+                    isinstance(state, (int, float))
+                    and isinstance(published, (int, float))
+                    and abs(state - published) < self._deadband
+                ):
+                    return False
+        return True
+
+    def published(self):
+        """Remember what was written and when."""
+        self._published_state = self._state
+        self._published_at = time.monotonic()
+        self._cancel_trailing_write()
+
+    def _schedule_trailing(self, delay):
+        if self._cancel_trailing is None:
+            self._cancel_trailing = async_call_later(
+                self.hass, delay, self._async_trailing_write
+            )
+
+    def _cancel_trailing_write(self):
+        if self._cancel_trailing is not None:
+            self._cancel_trailing()
+            self._cancel_trailing = None
+
+    @callback
+    def _async_trailing_write(self, now):
+        """Write a change held back by the minimum interval."""
+        self._cancel_trailing = None
+        self.update_from_model()
+        self.async_publish()
+
+    async def async_added_to_hass(self):
+        """Register update signal handler and the silence heartbeat."""
+        await super().async_added_to_hass()
+        self._published_state = self._state
+        self._published_at = time.monotonic()
+        self.async_on_remove(self._cancel_trailing_write)
+        if self._max_silence is not None:
+            self.async_on_remove(
+                async_track_time_interval(
+                    self.hass, self._async_heartbeat, self._max_silence
+                )
+            )
+
+    @callback
+    def _async_heartbeat(self, now):
+        """Publish the current state if nothing was written for too long."""
+        if time.monotonic() - self._published_at < self._max_silence.total_seconds():
+            return
+        self.update_from_model()
+        self._nest.stats["state_heartbeats"] += 1
+        self.async_write_state(state_fingerprint(self))
+        self.published()
+
+
+class NestBasicSensor(NestThrottledSensor):
     """Representation a basic Nest sensor."""
 
     @property
@@ -161,7 +278,7 @@ class NestBasicSensor(NestSensorDevice):
         """Return the device class of the sensor."""
         return SENSOR_DEVICE_CLASSES.get(self.variable)
     
-    def update(self):
+    def update_from_model(self):
         self._unit = SENSOR_UNITS.get(self.variable)
 
         if self.variable in VARIABLE_NAME_MAPPING:
@@ -176,7 +293,7 @@ class NestBasicSensor(NestSensorDevice):
         else:
             self._state = getattr(self.device, self.variable)
 
-class NestTempSensor(NestSensorDevice):
+class NestTempSensor(NestThrottledSensor):
     """Representation of a Nest Temperature sensor."""
 
     @property
@@ -189,13 +306,14 @@ class NestTempSensor(NestSensorDevice):
         """Return the device class of the sensor."""
         return DEVICE_CLASS_TEMPERATURE
     
-    def update(self):
-        if self.device.temperature_scale == "C":
+    def update_from_model(self):
+        device = self.device.snapshot()
+        if device.temperature_scale == "C":
             self._unit = TEMP_CELSIUS
         else:
             self._unit = TEMP_FAHRENHEIT
 
-        temp = getattr(self.device, self.variable)
+        temp = getattr(device, self.variable)
         if temp is None:
             self._state = None
         else:
@@ -203,4 +321,88 @@ class NestTempSensor(NestSensorDevice):
                 low, high = temp
                 self._state = f"{int(low)}-{int(high)}"
             else:
-                self._state = round(temp, 1)
\ No newline at end of file
+                self._state = round(temp, 1)
+
+
+class NestClientSensor(Entity):
+    """
+    Representation of the Nest client's data age. It is written every
+    FRESHNESS_INTERVAL rather than polled, and the client counters go to
+    the debug log instead of the state machine.
+    """
+
+    def __init__(self, nest):
+        """Initialize the sensor."""
+        self._nest = nest
+        self._state = None
+        self._attributes = {}
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return "Nest data age"
+
+    @property
+    def unique_id(self):
+        """Return a unique id for the client sensor."""
+        return f"{DOMAIN}-client"
+
+    @property
+    def should_poll(self):
+        """Written on its own interval."""
+        return False
+
+    @property
+    def state(self):
+        """Return seconds since the stalest subscription heard from Nest."""
+        return self._state
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit the value is expressed in."""
+        return TIME_SECONDS
+
+    @property
+    def device_state_attributes(self):
+        """Return when each subscription last heard from Nest."""
+        return self._attributes
+
+    async def async_added_to_hass(self):
+        """Register the refresh interval."""
+        self.async_on_remove(
+            async_track_time_interval(self.hass, self._async_refresh, FRESHNESS_INTERVAL)
+        )
+
+    async def async_update(self):
+        self.update_from_model()
+
+    @callback
+    def _async_refresh(self, now):
+        """Write the data age and log the client counters."""
+        self.update_from_model()
+        self.async_write_ha_state()
+        _LOGGER.debug(
+            "Nest client counters %s",
+            {
+                **self._nest.stats,
+                **scheduler.stats,
+                **executor.stats,
+                **write_executor.stats,
+                "io_queue_depth": executor.queue_depth,
+                "write_queue_depth": write_executor.queue_depth,
+            },
+        )
+
+    def update_from_model(self):
+        last_update = self._nest.last_update
+        if last_update is None:
+            self._state = None
+        else:
+            self._state = int((utcnow() - last_update).total_seconds())
+        self._attributes = {
+            ATTR_LAST_UPDATE: last_update,
+            **{
+                f"last_update_{'_'.join(buckets)}": shard_update
+                for buckets, shard_update in self._nest.nest.shard_updates
+            },
+        }
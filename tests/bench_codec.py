@@ -0,0 +1,78 @@
+"""
+Time decoding a synthetic app_launch response with the stdlib and orjson.
+
+    python tests/bench_codec.py [--devices N] [--repeat N]
+"""
+import argparse
+import json
+import timeit
+
+from nest_client import bucket, load
+
+codec = load('codec')
+nest = load()
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def app_launch(devices):
+    """An app_launch body for an account with devices thermostats and cameras."""
+    objects = [
+        bucket('structure.s1', {'name': 'Home', 'away': False, 'country_code': 'US'}),
+        bucket('where.s1', {'wheres': [
+            {'where_id': f'w{i}', 'name': f'Room {i}'} for i in range(devices)]}),
+    ]
+    for i in range(devices):
+        objects += [
+            bucket(f'link.t{i}', {'structure': 'structure.s1'}),
+            bucket(f'device.t{i}', {
+                'where_id': f'w{i}', 'temperature_scale': 'C', 'has_fan': True,
+                'current_humidity': 40, 'fan_timer_active': False,
+            }),
+            bucket(f'shared.t{i}', {
+                'target_temperature_type': 'heat', 'target_temperature': 20.5,
+                'current_temperature': 19.8, 'hvac_heater_state': False,
+                'can_heat': True, 'can_cool': False,
+            }),
+            bucket(f'quartz.c{i}', {
+                'where_id': f'w{i}', 'structure_id': 's1',
+                'streaming_state': 'streaming-enabled', 'is_online': True,
+                'activity_zones': [
+                    {'id': zone, 'name': f'zone {zone}'} for zone in range(10)],
+                'last_event': {'start_time': '2020-01-01T00:00:00Z', 'has_motion': True},
+            }),
+        ]
+    return json.dumps({'updated_buckets': objects}).encode()
+
+
+def chunks(body):
+    return [
+        body[start:start + nest.STREAM_CHUNK_SIZE]
+        for start in range(0, len(body), nest.STREAM_CHUNK_SIZE)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    body = app_launch(args.devices)
+    cases = {'json.loads': lambda: json.loads(body)}
+    if orjson is not None:
+        cases['orjson.loads'] = lambda: orjson.loads(body)
+    cases[f'codec.iter_items ({codec.NAME})'] = lambda: list(
+        codec.iter_items(chunks(body), 'updated_buckets'))
+
+    print(f'app_launch of {len(body) / 1024:.0f} KiB, best of {args.repeat}')
+    for name, decode in cases.items():
+        best = min(timeit.repeat(decode, number=1, repeat=args.repeat))
+        print(f'{name:32} {best * 1000:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Load the Nest client without Home Assistant and fake its transport."""
+import importlib
+import json
+import os
+import sys
+import types
+
+PACKAGE_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', 'custom_components', 'nestga'))
+PACKAGE = '_nestga_client'
+
+
+def load(module='nest'):
+    """Import a client module without the package __init__, which needs Home Assistant."""
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [PACKAGE_DIR]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f'{PACKAGE}.{module}')
+
+
+class FakeResponse(object):
+    def __init__(self, body=None, status_code=200, headers=None):
+        self.content = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def bucket(object_key, value, revision=1, timestamp=1):
+    return {
+        'object_key': object_key,
+        'object_revision': revision,
+        'object_timestamp': timestamp,
+        'value': value,
+    }
@@ -0,0 +1,83 @@
+"""Streaming the items of a JSON array out of a chunked response."""
+import json
+import random
+
+import pytest
+
+from nest_client import load
+
+codec = load('codec')
+
+
+def deep(depth):
+    value = {'leaf': 1}
+    for _ in range(depth):
+        value = {'d': [value, 'x]"{']}
+    return value
+
+
+ITEMS = [
+    {'object_key': 'shared.t1', 'value': {'s': 'x\\"y ] } {', 'n': [1, 2, {'z': None}]}},
+    'plain\\',
+    12.5,
+    -3,
+    True,
+    None,
+    [],
+    {},
+    {'name': 'Küche ☃ €'},
+    deep(codec.NESTED_DEPTH + 4),
+    [[[[[[[[[[[1]]]]]]]]]]],
+]
+DOCUMENT = json.dumps(
+    {'before': 'x' * 200, 'updated_buckets': ITEMS, 'after': [1]},
+    ensure_ascii=False,
+).encode()
+
+
+def split(document, count, rng):
+    cuts = sorted(rng.sample(range(1, len(document)), count))
+    return [document[start:end] for start, end in zip([0] + cuts, cuts + [len(document)])]
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 64, len(DOCUMENT)])
+def test_items_from_fixed_chunks(size):
+    chunks = [DOCUMENT[start:start + size] for start in range(0, len(DOCUMENT), size)]
+    assert list(codec.iter_items(chunks, 'updated_buckets')) == ITEMS
+
+
+def test_items_from_random_chunks():
+    rng = random.Random(36)
+    for _ in range(500):
+        chunks = split(DOCUMENT, rng.randint(0, 40), rng)
+        assert list(codec.iter_items(chunks, 'updated_buckets')) == ITEMS
+
+
+def test_items_are_yielded_as_they_arrive():
+    document = b'{"updated_buckets": [{"a": 1}, {"b": 2}'
+    items = codec.iter_items(iter([document, b']}']), 'updated_buckets')
+    assert next(items) == {'a': 1}
+    assert next(items) == {'b': 2}
+    assert list(items) == []
+
+
+def test_missing_key():
+    with pytest.raises(KeyError):
+        list(codec.iter_items([b'{"objects": []}'], 'updated_buckets'))
+
+
+def test_unterminated_array():
+    with pytest.raises(json.JSONDecodeError):
+        list(codec.iter_items([b'{"updated_buckets": [{"a": 1}, {"b"'], 'updated_buckets'))
+
+
+def test_items_are_decoded_by_the_codec(monkeypatch):
+    decoded = []
+
+    def loads(data):
+        decoded.append(bytes(data))
+        return json.loads(data)
+
+    monkeypatch.setattr(codec, 'loads', loads)
+    list(codec.iter_items([b'{"updated_buckets": [{"a": 1}, 2]}'], 'updated_buckets'))
+    assert decoded == [b'{"a": 1}', b'2']
@@ -0,0 +1,80 @@
+"""Memory footprint of the Nest client model across polling cycles."""
+import gc
+import tracemalloc
+
+from nest_client import FakeResponse, bucket, load
+
+CAMERAS = 20
+WARMUP_CYCLES = 50
+CYCLES = 200
+# Bytes the model may grow by over CYCLES polls, a leak of even one small
+# object per poll goes well past it
+MAX_GROWTH = 16 * 1024
+
+
+def camera_objects(cycle):
+    """One poll's worth of camera buckets, with a few fields moving."""
+    return [
+        bucket(f'quartz.camera{i}', revision=cycle, timestamp=cycle, value={
+            'where_id': 'where1',
+            'structure_id': 'structure1',
+            'streaming_state': 'streaming-enabled',
+            'is_online': True,
+            'activity_zones': [
+                {'id': zone, 'name': f'zone {zone}'} for zone in range(10)],
+            'last_event': {
+                'start_time': f'2020-01-01T00:00:{cycle % 7:02}Z',
+                'has_motion': cycle % 2 == 0,
+            },
+        })
+        for i in range(CAMERAS)
+    ]
+
+
+def fake_nest(monkeypatch):
+    nest = load()
+    cycle = [0]
+
+    def request(kind, method, url, session=None, **kwargs):
+        cycle[0] += 1
+        objects = camera_objects(cycle[0])
+        return FakeResponse({'updated_buckets': objects, 'objects': objects})
+
+    monkeypatch.setattr(nest.scheduler, 'request', request)
+    return nest.Nest('token', 'user', 'https://transport', buckets=['quartz'])
+
+
+def traced_size():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def poll(client, cycles):
+    for _ in range(cycles):
+        client.update()
+        client.pop_changed()
+
+
+def test_storage_stays_flat_across_polls(monkeypatch):
+    client = fake_nest(monkeypatch)
+    tracemalloc.start()
+    try:
+        poll(client, WARMUP_CYCLES)
+        before = traced_size()
+        poll(client, CYCLES)
+        after = traced_size()
+    finally:
+        tracemalloc.stop()
+    assert len(client.cameras) == CAMERAS
+    assert after - before < MAX_GROWTH
+
+
+def test_repeated_values_are_shared(monkeypatch):
+    client = fake_nest(monkeypatch)
+    poll(client, 2)
+    first, second = list(client.cameras)[:2]
+    assert first._data.streaming_state is second._data.streaming_state
+    # Unchanged nested objects are kept rather than replaced
+    zones = first._data.activity_zones
+    poll(client, 1)
+    assert first._data.activity_zones is zones
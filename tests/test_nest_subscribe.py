@@ -0,0 +1,48 @@
+"""The subscribe cycle of the Nest client."""
+import threading
+
+import requests
+
+from nest_client import FakeResponse, bucket, load
+
+nest = load()
+
+
+def test_idle_long_poll_is_an_empty_cycle(monkeypatch):
+    def request(kind, method, url, session=None, **kwargs):
+        if url.endswith(nest.ENDPOINT_SUBSCRIBE):
+            raise requests.exceptions.ReadTimeout()
+        return FakeResponse({'updated_buckets': [
+            bucket('structure.s1', {'name': 'Home'}),
+        ]})
+
+    monkeypatch.setattr(nest.scheduler, 'request', request)
+    client = nest.Nest('token', 'user', 'https://transport', stream_app_launch=False)
+    client._shard_updates[0] = None
+    client.update(shard=0)
+    assert client.stats['idle_polls'] == 1
+    assert client.last_update is not None
+
+
+def test_subscribe_body_keeps_a_set_made_while_encoding(monkeypatch):
+    body = nest.SubscribeBody()
+    body.set('shared.t1', 1, 1)
+    dumps = nest.codec.dumps
+    writers = []
+
+    def dumps_while_writing(obj):
+        encoded = dumps(obj)
+        if not writers:
+            # Another thread sets a revision while this one encodes
+            writer = threading.Thread(target=body.set, args=('shared.t1', 2, 2))
+            writers.append(writer)
+            writer.start()
+            writer.join(0.2)
+        return encoded
+
+    monkeypatch.setattr(nest.codec, 'dumps', dumps_while_writing)
+    body.payload
+    writers[0].join()
+    assert nest.codec.loads(body.payload)['objects'] == [
+        {'object_key': 'shared.t1', 'object_revision': 2, 'object_timestamp': 2},
+    ]
@@ -0,0 +1,152 @@
+"""Writes to the Nest web API and the confirmation of their revisions."""
+import pytest
+
+from nest_client import FakeResponse, bucket, load
+
+nest = load()
+
+
+class FakeTransport(object):
+    """A Nest account served from memory, recording what is sent to it."""
+
+    def __init__(self):
+        self.buckets = {
+            'structure.s1': {'name': 'Home', 'away': False},
+            'where.s1': {'wheres': [{'where_id': 'w1', 'name': 'Hall'}]},
+            'link.t1': {'structure': 'structure.s1'},
+            'device.t1': {'where_id': 'w1', 'temperature_scale': 'C'},
+            'shared.t1': {'target_temperature_type': 'heat', 'target_temperature': 20.0},
+        }
+        self.revisions = dict.fromkeys(self.buckets, 1)
+        self.puts = []
+        self.subscribes = []
+        # Called with each PUT body before it is answered
+        self.on_put = None
+
+    def object(self, object_key):
+        revision = self.revisions[object_key]
+        return bucket(object_key, self.buckets[object_key], revision, revision)
+
+    def request(self, kind, method, url, session=None, data=None, **kwargs):
+        body = nest.codec.loads(data)
+        if url.endswith(nest.ENDPOINT_PUT):
+            self.puts.append(body)
+            if self.on_put is not None:
+                self.on_put(body)
+            for written in body['objects']:
+                key = written['object_key']
+                value = {**self.buckets[key], **written['value']}
+                if value != self.buckets[key]:
+                    self.buckets[key] = value
+                    self.revisions[key] += 1
+            return FakeResponse({'objects': [
+                {'object_key': written['object_key'],
+                 'object_revision': self.revisions[written['object_key']]}
+                for written in body['objects']
+            ]})
+        if url.endswith(nest.ENDPOINT_SUBSCRIBE):
+            self.subscribes.append(body)
+            return FakeResponse({'objects': [
+                self.object(known['object_key']) for known in body['objects']
+                if self.revisions[known['object_key']] != known['object_revision']
+            ]})
+        return FakeResponse({'updated_buckets': [self.object(key) for key in self.buckets]})
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    transport = FakeTransport()
+    monkeypatch.setattr(nest.scheduler, 'request', transport.request)
+    return transport
+
+
+@pytest.fixture
+def client(transport):
+    return nest.Nest('token', 'user', 'https://transport', stream_app_launch=False)
+
+
+def test_write_confirms_against_the_revision_it_started_from(client, transport):
+    client.thermostat('t1').target = 21
+    assert transport.subscribes == [{'objects': [
+        {'object_key': 'shared.t1', 'object_revision': 1, 'object_timestamp': 1},
+    ]}]
+    assert client.thermostat('t1').target == 21
+    assert not client._pending_writes
+
+
+def test_write_skips_confirm_when_the_long_poll_got_there_first(client, transport):
+    def long_poll(body):
+        transport.revisions['shared.t1'] += 1
+        client._apply_object(transport.object('shared.t1'), client._objects, set())
+
+    transport.on_put = long_poll
+    client.thermostat('t1').target = 21
+    assert transport.subscribes == []
+
+
+def test_write_skips_confirm_when_nothing_changed(client, transport):
+    client.thermostat('t1').target = 20
+    assert len(transport.puts) == 1
+    assert transport.subscribes == []
+    assert not client._pending_writes
+    assert client.stats['writes_unchanged'] == 1
+
+
+def put(object_key, value):
+    return {'objects': [{'object_key': object_key, 'op': 'MERGE', 'value': value}]}
+
+
+def test_target_temperature_put(client, transport):
+    client.thermostat('t1').target = 21.4
+    assert transport.puts == [put('shared.t1', {'target_temperature': 21.5})]
+
+
+def test_target_range_put(client, transport):
+    transport.buckets['shared.t1']['target_temperature_type'] = 'range'
+    client = nest.Nest('token', 'user', 'https://transport', stream_app_launch=False)
+    thermostat = client.thermostat('t1')
+    assert thermostat.mode == 'heat-cool'
+    thermostat.target = (19, 23)
+    assert transport.puts == [put(
+        'shared.t1', {'target_temperature_low': 19, 'target_temperature_high': 23})]
+
+
+@pytest.mark.parametrize('mode, web_mode', [
+    ('heat', 'heat'),
+    ('cool', 'cool'),
+    ('heat-cool', 'range'),
+    ('off', 'off'),
+])
+def test_hvac_mode_put(client, transport, mode, web_mode):
+    client.thermostat('t1').mode = mode
+    assert transport.puts == [put('shared.t1', {'target_temperature_type': web_mode})]
+
+
+@pytest.mark.parametrize('away, web_away', [
+    ('away', True),
+    ('home', False),
+    (True, True),
+    (False, False),
+])
+def test_away_put(client, transport, away, web_away):
+    client.structure('s1').away = away
+    assert transport.puts == [put('structure.s1', {'away': web_away})]
+
+
+def test_away_reads_as_legacy_value(client, transport):
+    assert client.structure('s1').away == 'home'
+    client.structure('s1').away = 'away'
+    assert client.structure('s1').away == 'away'
+
+
+@pytest.mark.parametrize('write', [
+    lambda client: setattr(client.thermostat('t1'), 'mode', 'eco'),
+    lambda client: setattr(client.thermostat('t1'), 'eco_temperature', (15, 28)),
+    lambda client: setattr(client.thermostat('t1'), 'fan', True),
+    lambda client: setattr(client.thermostat('t1'), 'temperature_scale', 'F'),
+    lambda client: setattr(client.structure('s1'), 'name', 'Cabin'),
+])
+def test_unmapped_writes_are_refused(client, transport, write):
+    with pytest.raises(NotImplementedError):
+        write(client)
+    assert transport.puts == []
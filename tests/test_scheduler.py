@@ -0,0 +1,242 @@
+"""Rate limiting and circuit breaking of the shared request scheduler."""
+import email.utils
+import threading
+import time
+
+import pytest
+import requests
+
+from nest_client import FakeResponse, load
+
+scheduler_module = load('scheduler')
+
+
+class FakeSession(object):
+    """Answers requests from a list of responses or exceptions."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def scheduler():
+    # No rate limit worth waiting on
+    limits = dict.fromkeys(scheduler_module.PRIORITIES, (1000, 1000))
+    return scheduler_module.Scheduler(limits, (1000, 1000))
+
+
+def test_read_timeouts_dont_open_the_circuit(scheduler):
+    threshold = scheduler_module.FAILURE_THRESHOLD
+    session = FakeSession(*[requests.exceptions.ReadTimeout()] * (threshold + 1))
+    for _ in range(threshold + 1):
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            scheduler.request(scheduler_module.POLL, 'post', 'https://host/v5/subscribe', session)
+    assert len(session.requests) == threshold + 1
+    assert scheduler.stats['circuit_opened'] == 0
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    bucket = scheduler_module.TokenBucket(2, 3)
+    now = time.monotonic()
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.take()
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == pytest.approx(0)
+    # Never more than the burst is kept, or asked for
+    assert bucket.delay(now + 60, tokens=10) == 0
+
+
+def test_waiting_writes_hold_host_slots_back_from_polls():
+    # Ten host slots a second, two at once
+    scheduler = scheduler_module.Scheduler(
+        dict.fromkeys(scheduler_module.PRIORITIES, (1000, 1000)), (10, 2))
+    scheduler.acquire('host', scheduler_module.POLL)
+
+    started = time.monotonic()
+    scheduler.acquire('host', scheduler_module.POLL)
+    assert time.monotonic() - started < 0.05
+
+    # With a write waiting, a poll needs a slot left over for it
+    with scheduler._condition:
+        scheduler._waiting['host', scheduler_module.PRIORITIES[scheduler_module.WRITE]] += 1
+    try:
+        started = time.monotonic()
+        scheduler.acquire('host', scheduler_module.POLL)
+        assert time.monotonic() - started >= 0.15
+    finally:
+        with scheduler._condition:
+            scheduler._waiting['host', scheduler_module.PRIORITIES[scheduler_module.WRITE]] -= 1
+
+
+def test_write_is_served_before_a_waiting_poll():
+    scheduler = scheduler_module.Scheduler(
+        dict.fromkeys(scheduler_module.PRIORITIES, (1000, 1000)), (10, 2))
+    scheduler.acquire('host', scheduler_module.POLL)
+    scheduler.acquire('host', scheduler_module.POLL)
+    order = []
+
+    def acquire(kind):
+        scheduler.acquire('host', kind)
+        order.append(kind)
+
+    poll = threading.Thread(target=acquire, args=(scheduler_module.POLL,))
+    poll.start()
+    # Let the poll start waiting before the write arrives
+    time.sleep(0.02)
+    acquire(scheduler_module.WRITE)
+    poll.join()
+    assert order == [scheduler_module.WRITE, scheduler_module.POLL]
+
+
+@pytest.mark.parametrize('header, seconds', [
+    (None, scheduler_module.RETRY_AFTER_DEFAULT),
+    ('12', 12),
+    ('1.5', 1.5),
+    ('-5', 0),
+    ('soon', scheduler_module.RETRY_AFTER_DEFAULT),
+])
+def test_retry_after(header, seconds):
+    headers = {} if header is None else {'Retry-After': header}
+    assert scheduler_module._retry_after(FakeResponse(b'', 429, headers)) == seconds
+
+
+def test_retry_after_date():
+    header = email.utils.formatdate(time.time() + 60, usegmt=True)
+    seconds = scheduler_module._retry_after(FakeResponse(b'', 429, {'Retry-After': header}))
+    assert 55 <= seconds <= 60
+
+
+@pytest.mark.parametrize('status, headers', [
+    (429, {'Retry-After': '1000'}),
+    (429, {}),
+    (503, {'Retry-After': '7'}),
+])
+def test_throttled_responses_hold_the_host_back(scheduler, status, headers):
+    response = FakeResponse(b'', status, headers)
+    with pytest.raises(scheduler_module.RateLimited) as raised:
+        scheduler.request(
+            scheduler_module.POLL, 'get', 'https://host/', FakeSession(response))
+    expected = min(
+        scheduler_module.RETRY_AFTER_MAX,
+        float(headers.get('Retry-After', scheduler_module.RETRY_AFTER_DEFAULT)))
+    assert raised.value.retry_after == expected
+    assert response.closed
+    assert scheduler._blocked_until['host'] > time.monotonic() + expected - 5
+    assert scheduler.stats['rate_limited'] == 1
+    # Throttling says the host is up
+    assert scheduler.stats['circuit_opened'] == 0
+    assert scheduler.breaker('host')._failures == 0
+
+
+class FakeClock(object):
+    """Stands in for the time module, with a monotonic clock moved by hand."""
+
+    def __init__(self):
+        self.now = time.monotonic()
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return time.time()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler_module, 'time', clock)
+    return clock
+
+
+def test_breaker_opens_probes_and_closes(clock):
+    breaker = scheduler_module.CircuitBreaker(threshold=3, probe_interval=30)
+    assert not breaker.failed()
+    assert not breaker.failed()
+    breaker.before('host')
+    assert breaker.failed()
+
+    with pytest.raises(scheduler_module.CircuitOpen) as raised:
+        breaker.before('host')
+    assert raised.value.retry_after == 30
+
+    # One probe per interval, failing it waits out another interval
+    clock.now += 30
+    breaker.before('host')
+    with pytest.raises(scheduler_module.CircuitOpen):
+        breaker.before('host')
+    assert not breaker.failed()
+    clock.now += 29
+    with pytest.raises(scheduler_module.CircuitOpen) as raised:
+        breaker.before('host')
+    assert raised.value.retry_after == pytest.approx(1)
+
+    clock.now += 1
+    breaker.before('host')
+    breaker.succeeded()
+    for _ in range(5):
+        breaker.before('host')
+    # The count starts over once closed
+    assert not breaker.failed()
+
+
+def test_released_probe_lets_the_next_one_out(clock):
+    breaker = scheduler_module.CircuitBreaker(threshold=1, probe_interval=30)
+    assert breaker.failed()
+    clock.now += 30
+    breaker.before('host')
+    breaker.released()
+    breaker.before('host')
+    with pytest.raises(scheduler_module.CircuitOpen):
+        breaker.before('host')
+
+
+def test_request_goes_through_the_circuit(clock, scheduler):
+    threshold = scheduler_module.FAILURE_THRESHOLD
+    session = FakeSession(
+        *[requests.exceptions.ConnectionError()] * threshold,
+        FakeResponse(b'', 500),
+        FakeResponse(b'', 200))
+    for _ in range(threshold):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            scheduler.request(scheduler_module.POLL, 'get', 'https://host/', session)
+    assert scheduler.stats['circuit_opened'] == 1
+
+    with pytest.raises(scheduler_module.CircuitOpen):
+        scheduler.request(scheduler_module.POLL, 'get', 'https://host/', session)
+    assert len(session.requests) == threshold
+    assert scheduler.stats['circuit_rejected'] == 1
+
+    # A server error on the probe keeps the circuit open
+    clock.now += scheduler_module.PROBE_INTERVAL
+    assert scheduler.request(
+        scheduler_module.POLL, 'get', 'https://host/', session).status_code == 500
+    with pytest.raises(scheduler_module.CircuitOpen):
+        scheduler.request(scheduler_module.POLL, 'get', 'https://host/', session)
+
+    clock.now += scheduler_module.PROBE_INTERVAL
+    assert scheduler.request(
+        scheduler_module.POLL, 'get', 'https://host/', session).status_code == 200
+    assert scheduler.stats['circuit_opened'] == 1
+    scheduler.breaker('host').before('host')
+
+
+def test_probe_raising_outside_requests_is_not_left_outstanding(clock, scheduler):
+    breaker = scheduler.breaker('host')
+    for _ in range(scheduler_module.FAILURE_THRESHOLD):
+        breaker.failed()
+    clock.now += scheduler_module.PROBE_INTERVAL
+    with pytest.raises(ValueError):
+        scheduler.request(
+            scheduler_module.POLL, 'get', 'https://host/', FakeSession(ValueError()))
+    # The failed probe restarted the interval rather than blocking probes for good
+    clock.now += scheduler_module.PROBE_INTERVAL
+    breaker.before('host')